@@ -1,39 +1,54 @@
 import threading
-from dotenv import load_dotenv
 import uvicorn
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from typing import List, Optional, Dict, Any
+from cachetools import TTLCache
 import logging
+import bootstrap
 from contracts import VendorResponses, FlightUpdateRequest
 from postgres_client import PostgresClient
 from rabbitmq_client import RabbitMQClient
-from email_processor import EmailProcessor
-from search_orchestrator import  SearchOrchestrator
-from tools.flight_finder import FlightFinderClient
 from contextlib import asynccontextmanager
 
 
-load_dotenv()
-
-# Configure logging
-logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
+# Load .env and configure logging before any client reads its settings
+bootstrap.init()
 
 logger = logging.getLogger(__name__)
 
 # Initialize clients
 rabbitmq_client = RabbitMQClient()
-email_processor = EmailProcessor()
-flight_finder = FlightFinderClient()
 db = PostgresClient()
 
-# Initialize orchestrator
-orchestrator = SearchOrchestrator(
-	   rabbitmq_client=rabbitmq_client,
-	   email_processor=email_processor,
-  	   flight_finder=flight_finder,
-  	   postgres_client=db
-)
+orchestrator = None
+orchestrator_lock = threading.Lock()
+consumer_thread = None
+
+
+def get_orchestrator():
+	"""
+	The orchestrator, built on first use.
+
+	This is what imports openai, selectolax and the rest of the processing stack. The lifespan
+	builds it before the API starts serving, so a misconfiguration fails startup.
+	"""
+	global orchestrator
+	with orchestrator_lock:
+		if orchestrator is None:
+			from email_processor import EmailProcessor
+			from search_orchestrator import SearchOrchestrator
+			from tools.flight_finder import FlightFinderClient
+
+			orchestrator = SearchOrchestrator(
+				rabbitmq_client=rabbitmq_client,
+				email_processor=EmailProcessor(),
+				flight_finder=FlightFinderClient(),
+				postgres_client=db
+			)
+	return orchestrator
 
 
 def run_rabbitmq():
@@ -41,21 +56,26 @@ def run_rabbitmq():
 	try:
 		logger.info("Starting RabbitMQ consumer...")
 		# Start consuming emails
-		orchestrator.consume_emails()
+		get_orchestrator().consume_emails()
 	except Exception as e:
 		logger.error(f"RabbitMQ consumer error: {str(e)}")
 		raise
 
 def start_rabbitmq_consumer():
 	"""Start the RabbitMQ consumer in a separate thread"""
+	global consumer_thread
 	rabbitmq_thread = threading.Thread(target=run_rabbitmq)
 	rabbitmq_thread.daemon = True  # This ensures the thread will exit when the main program exits
 	rabbitmq_thread.start()
+	consumer_thread = rabbitmq_thread
 	logger.info("RabbitMQ consumer thread started")
 
 # Start the RabbitMQ consumer when the application starts
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+	# Built here rather than in the consumer thread, where a missing OPENAI_API_KEY or a bad
+	# CONSUMER_WORKERS would only kill that thread and leave the API up without a consumer
+	get_orchestrator()
 	start_rabbitmq_consumer()
 	yield
 
@@ -63,7 +83,8 @@ app = FastAPI(
 	title="JetFinder API",
 	description="API for managing flight search and vendor responses",
 	version="1.0.0",
-	lifespan=lifespan
+	lifespan=lifespan,
+	default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -80,21 +101,34 @@ app.add_middleware(
 async def root():
 	return {"message": "Welcome to JetFinder API"}
 
+# A burst of probes within a second reuses the last healthy result instead of hitting Postgres and RabbitMQ
+health_cache = TTLCache(maxsize=1, ttl=1)
+
 @app.get("/health")
 async def health_check():
 	"""
 	Health check endpoint for Fly.io to monitor application health.
 	This endpoint should return a 200 OK response if the application is healthy.
 	"""
+	# A single get, the entry can expire between a membership test and the lookup
+	cached = health_cache.get("health")
+	if cached is not None:
+		return cached
+
 	try:
 		# Check database connection
-		with db.get_connection() as conn:
-			conn.execute("SELECT 1")
+		await run_in_threadpool(db.ping)
 		
-		# Check RabbitMQ connection
-		rabbitmq_client.ensure_connection()
+		# Nothing restarts the consumer, if it died the API is up but no email is processed
+		if consumer_thread is not None and not consumer_thread.is_alive():
+			raise RuntimeError("RabbitMQ consumer thread is not running")
+
+		# Check RabbitMQ connection, reconnecting retries with backoff so it can block for a while
+		await run_in_threadpool(rabbitmq_client.ensure_connection)
 		
-		return {"status": "healthy", "database": "connected", "rabbitmq": "connected"}
+		health = {"status": "healthy", "database": "connected", "rabbitmq": "connected", "database_pool": db.pool_stats()}
+		health_cache["health"] = health
+		return health
 	except Exception as e:
 		logger.error(f"Health check failed: {str(e)}")
 		raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
@@ -102,7 +136,9 @@ async def health_check():
 @app.post("/recompute-flight-plan", response_model=dict)
 async def recompute_flight_plan(request: FlightUpdateRequest):
 	try:
-		response = orchestrator.update_flight_search(request)
+		# The search and database calls block, keep them off the event loop
+		orchestrator = get_orchestrator()
+		response = await run_in_threadpool(orchestrator.update_flight_search, request)
 
 		if response == orchestrator.UnknownError:
 			raise HTTPException(status_code=500, detail="Unknown error")
@@ -113,24 +149,41 @@ async def recompute_flight_plan(request: FlightUpdateRequest):
 	except Exception as e:
 		logger.error(f"Error creating vendor response: {str(e)}")
 		raise 
-@app.get("/vendor-responses/{user_id}", response_model=VendorResponses)
+# VendorResponses only documents the payload, returning the response directly skips re-validating every row
+@app.get("/vendor-responses/{user_id}", responses={200: {"model": VendorResponses}})
 async def get_vendor_responses(
 	user_id: str,
 	page: int = 1,
 	page_size: int = 10,
-	sort_order: str = 'desc'
+	sort_order: str = 'desc',
+	cursor: Optional[str] = None
 ):
 	try:
-		return db.get_vendor_responses_for_user(
+		vendor_responses = await run_in_threadpool(
+			db.get_vendor_responses_for_user,
 			user_id=user_id,
 			page=page,
 			page_size=page_size,
-			sort_order=sort_order
+			sort_order=sort_order,
+			cursor=cursor
 		)
+		return ORJSONResponse(vendor_responses)
 	except Exception as e:
 		logger.error(f"Error getting vendor responses: {str(e)}")
 		raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/vendor-responses/{user_id}/{response_id}")
+async def get_vendor_response_detail(user_id: str, response_id: str):
+	try:
+		vendor_response = await run_in_threadpool(db.get_vendor_response_detail, user_id, response_id)
+	except Exception as e:
+		logger.error(f"Error getting vendor response: {str(e)}")
+		raise HTTPException(status_code=500, detail=str(e))
+
+	if vendor_response is None:
+		raise HTTPException(status_code=404, detail="Vendor response not found")
+	return ORJSONResponse(vendor_response)
+
 
 if __name__ == "__main__":
 	uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
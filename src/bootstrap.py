@@ -0,0 +1,25 @@
+import logging
+from dotenv import load_dotenv
+
+# Set once per process, every entrypoint and client calls in here but .env is only read once
+_env_loaded = False
+_initialized = False
+
+
+def load_env():
+	"""Load .env into the environment, later calls are no-ops"""
+	global _env_loaded
+	if _env_loaded:
+		return
+	load_dotenv()
+	_env_loaded = True
+
+
+def init():
+	"""Load .env and configure logging for an entrypoint, later calls are no-ops"""
+	global _initialized
+	if _initialized:
+		return
+	load_env()
+	logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
+	_initialized = True
@@ -3,9 +3,12 @@ from typing import List, Optional
 
 class VendorResponses(BaseModel):
 	responses: List[dict]
-	total: int
-	page: int
-	total_pages: int
+	# Only computed for offset pages, pages requested by cursor leave them unset
+	total: Optional[int] = None
+	page: Optional[int] = None
+	total_pages: Optional[int] = None
+	# Pass back as cursor to get the following page, None on the last page
+	next_cursor: Optional[str] = None
 
 
 # Pydantic models for request/response validation
@@ -1,9 +1,105 @@
-import json
+import asyncio
+import functools
+import hashlib
+import logging
 import os
-from openai import OpenAI
+import re
+import orjson
+import openai_client
 from typing import Dict, Any, List, Tuple
+from dataclasses import dataclass
 from datetime import datetime
 import pytz
+from redis_cache import RedisCache
+
+# Footer appended to every Flight Finder form email, it carries no request information
+BOILERPLATE_MARKERS = ("Flight Finder Exclusive",)
+# A marker further from the end than this is quoted or banner text, not the footer
+FOOTER_MAX_LENGTH = 500
+WHITESPACE = re.compile(r"\s+")
+# The travel date format the analysis prompt asks for
+TRAVEL_DATE_FORMAT = "%Y-%m-%d %H:%M UTC"
+# Words any charter request mentions somewhere, emails without one of them are not worth an LLM call
+CHARTER_HINTS = re.compile(
+	r"\b(charter|passengers?|pax|jet|fly|flight|flying|aircraft|itinerary|tail number|airport|one[- ]way|round[- ]trip)\b",
+	re.IGNORECASE
+)
+
+
+def normalize_email_body(email_body: str) -> str:
+	"""
+	Strip the trailing footer and whitespace differences so templated resends hash the same.
+
+	Only a footer at the very end is stripped, cutting at a marker higher up would make
+	different requests (and their contact details) share one cached analysis
+	"""
+	for marker in BOILERPLATE_MARKERS:
+		index = email_body.rfind(marker)
+		if index != -1 and len(email_body) - index <= FOOTER_MAX_LENGTH:
+			email_body = email_body[:index]
+	return WHITESPACE.sub(" ", email_body).strip()
+
+
+def analysis_cache_key(email_body: str) -> str:
+	return hashlib.blake2b(normalize_email_body(email_body).encode(), digest_size=16).hexdigest()
+
+
+def parse_travel_date(travel_date: str) -> datetime:
+	"""Strictly parse a travel date in the analysis prompt's format, the result is always naive so legs compare"""
+	return datetime.strptime(travel_date, TRAVEL_DATE_FORMAT)
+
+
+@dataclass
+class FlightLegs:
+	"""The legs of a flight plan as parallel lists, pulled out of the analysis dicts in one pass"""
+	origins: List[str]
+	destinations: List[str]
+	dates: List[datetime]
+
+	@classmethod
+	def from_flights(cls, flights: List[Dict[str, Any]]) -> "FlightLegs":
+		"""Raises ValueError when there are no flights"""
+		origins, destinations, dates = zip(*[
+			(flight["origin"], flight["destination"], parse_travel_date(flight["travel_date"]))
+			for flight in flights
+		])
+		return cls(list(origins), list(destinations), list(dates))
+
+
+def cached_analysis(func):
+	"""Cache-aside wrapper for email analyses, keyed by a hash of the normalized email body"""
+	if asyncio.iscoroutinefunction(func):
+		@functools.wraps(func)
+		async def async_wrapper(self, email_body: str) -> Dict[str, Any]:
+			# The cache may make a blocking Redis roundtrip, which must not stall the other
+			# completions in flight on the shared event loop
+			key = analysis_cache_key(email_body)
+			analysis = await asyncio.to_thread(self.analysis_cache.get, key)
+			if analysis is not None:
+				return analysis
+
+			analysis = await func(self, email_body)
+			if analysis is not None:
+				await asyncio.to_thread(self.analysis_cache.set, key, analysis)
+			return analysis
+
+		return async_wrapper
+
+	@functools.wraps(func)
+	def wrapper(self, email_body: str) -> Dict[str, Any]:
+		key = analysis_cache_key(email_body)
+		analysis = self.analysis_cache.get(key)
+		if analysis is not None:
+			return analysis
+
+		analysis = func(self, email_body)
+		if analysis is not None:
+			self.analysis_cache.set(key, analysis)
+		return analysis
+
+	return wrapper
+
+
 class EmailProcessor:
 	example_client_completion = """
 	{{
@@ -58,172 +154,222 @@ class EmailProcessor:
 	}}
 	"""
 
+	example_client_request_email = """
+		<User First Name> Your Itinerary :
+		KDFW | Dallas Fort Worth International Airport | Dallas-Fort Worth, US KMSY | Louis Armstrong New Orleans International Airport | New Orleans, US | 2025-05-14 20:29 | PAX: 3
+		KMSY | Louis Armstrong New Orleans International Airport | New Orleans, US KDFW | Dallas Fort Worth International Airport | Dallas-Fort Worth, US | 2025-05-17 20:30 | PAX: 3
+		Aircraft Size: Piston Prop 
+		First Name: <User First Name>
+		Last Name: <User Last Name>
+		Email: <User Email> 
+		Phone - (Reliable # for time sensitive travel): <User Phone Number>
+		State: TX
+		How many hours do you fly privately each year?: 0-10 hours
+		Firm trip or General Inquiry: This trip is 100% Firm 
+	"""
+
+	example_client_request_email_2 = """
+		<User First Name> Your Itinerary :
+		  KFTY | Fulton County Airport Brown Field | Atlanta, US KJFK | John F Kennedy International Airport | New York, US | 2025-08-08 10:30 | PAX: 4
+		  Aircraft Size: Not sure, please advise me
+		  First Name: <User First Name>
+		  Last Name: <User Last Name>
+		  Email: <User Email>
+		  Phone - (Reliable # for time sensitive travel): <User Phone Number>
+		  State: NJ
+		  How many hours do you fly privately each year?: 0-10 hours
+		  Firm trip or General Inquiry: Looking for general info on a route I'm interested in
+	"""
+
+	# Built once at import, this prefix is what OpenAI's prompt caching can reuse between emails
+	_SYSTEM_PROMPT = f"""
+	You are an AI assistant that analyzes emails for private jet charter requests.
+
+	Analyze the email in the <content> block of the user message and determine if it's a request for chartering a private jet.
+	If it is, extract the following information:
+	- Origin airport/city
+	- Destination airport/city
+	- Date of travel
+	- Number of passengers
+	- Any specific requirements
+
+	Respond in JSON format with the following structure:
+	{{
+		"is_charter_request": boolean,
+		"user_info": {{
+			"user_email": string or null,
+			"user_phone": string or null,
+			"user_state": string or null,
+			"user_first_name": string or null,
+			"user_last_name": string or null,
+		}}
+		"flights": [
+			{{
+				"origin": string or null,
+				"destination": string or null,
+				"travel_date": string or null (the format MUST be YYYY-MM-DD HH:MM UTC),
+				"passengers": number or null,
+				"aircraft_size": string or null,
+			}}
+		],
+	}}
+
+	'aircraft_size' must be one of the following:
+	{{
+		'Ultra Long Range',
+		'Super Midsize Jet',
+		'Very Light Jet',
+		'Piston Prop',
+		'Midsize Jet',
+		'Turbo Prop',
+		'Light Jet',
+		'Heavy Jet'
+		'Any',
+	}}
+
+	If you determine that the email is not a private jet charter request, respond with:
+	{{
+		"is_charter_request": false
+	}}
+
+	<examples>
+	Here's an example of what a private jet charter request looks like:
+	
+	{example_client_request_email}
+
+	Here's what I would expect the completion to be:
+
+	{example_client_completion}
+
+	Here's another example of what a private jet charter request looks like:
+
+	{example_client_request_email_2}
+
+	Here's what I would expect the completion to be:
+
+	{example_client_completion_2}
+	</examples>
+	"""
+
 	def __init__(self):
 		api_key = os.getenv('OPENAI_API_KEY')
 		if not api_key:
 			raise ValueError("OPENAI_API_KEY environment variable is not set")
-		self.client = OpenAI(api_key=api_key)
-		
-		
+		self.client = openai_client.get_client()
+		self.aclient = openai_client.get_async_client()
+		self.analysis_cache = RedisCache(prefix="llm:", ttl=86400)
+
+	@cached_analysis
 	def analyze_incoming_email(self, email_body: str) -> Dict[str, Any]:
-		example_client_request_email = """
-			<User First Name> Your Itinerary :
-			KDFW | Dallas Fort Worth International Airport | Dallas-Fort Worth, US KMSY | Louis Armstrong New Orleans International Airport | New Orleans, US | 2025-05-14 20:29 | PAX: 3
-			KMSY | Louis Armstrong New Orleans International Airport | New Orleans, US KDFW | Dallas Fort Worth International Airport | Dallas-Fort Worth, US | 2025-05-17 20:30 | PAX: 3
-			Aircraft Size: Piston Prop 
-			First Name: <User First Name>
-			Last Name: <User Last Name>
-			Email: <User Email> 
-			Phone - (Reliable # for time sensitive travel): <User Phone Number>
-			State: TX
-			How many hours do you fly privately each year?: 0-10 hours
-			Firm trip or General Inquiry: This trip is 100% Firm 
-		"""
-	
-		example_client_request_email_2 = """
-			<User First Name> Your Itinerary :
-			  KFTY | Fulton County Airport Brown Field | Atlanta, US KJFK | John F Kennedy International Airport | New York, US | 2025-08-08 10:30 | PAX: 4
-			  Aircraft Size: Not sure, please advise me
-			  First Name: <User First Name>
-			  Last Name: <User Last Name>
-			  Email: <User Email>
-			  Phone - (Reliable # for time sensitive travel): <User Phone Number>
-			  State: NJ
-			  How many hours do you fly privately each year?: 0-10 hours
-			  Firm trip or General Inquiry: Looking for general info on a route I'm interested in
-		"""
-	
-		prompt = f"""
-		Analyze the following email and determine if it's a request for chartering a private jet.
-		If it is, extract the following information:
-		- Origin airport/city
-		- Destination airport/city
-		- Date of travel
-		- Number of passengers
-		- Any specific requirements
-
-		Respond in JSON format with the following structure:
-		{{
-			"is_charter_request": boolean,
-			"user_info": {{
-				"user_email": string or null,
-				"user_phone": string or null,
-				"user_state": string or null,
-				"user_first_name": string or null,
-				"user_last_name": string or null,
-			}}
-			"flights": [
-				{{
-					"origin": string or null,
-					"destination": string or null,
-					"travel_date": string or null (the format MUST be YYYY-MM-DD HH:MM UTC),
-					"passengers": number or null,
-					"aircraft_size": string or null,
-				}}
-			],
-		}}
+		response = self.client.chat.completions.create(
+			model="gpt-4o-mini",
+			messages=self.build_analysis_messages(email_body),
+			response_format={ "type": "json_object" }
+		)
+		return self.parse_analysis(response)
 
-		'aircraft_size' must be one of the following:
-		{{
-			'Ultra Long Range',
-			'Super Midsize Jet',
-			'Very Light Jet',
-			'Piston Prop',
-			'Midsize Jet',
-			'Turbo Prop',
-			'Light Jet',
-			'Heavy Jet'
-			'Any',
-		}}
+	@cached_analysis
+	async def analyze_incoming_email_async(self, email_body: str) -> Dict[str, Any]:
+		response = await self.aclient.chat.completions.create(
+			model="gpt-4o-mini",
+			messages=self.build_analysis_messages(email_body),
+			response_format={ "type": "json_object" }
+		)
+		return self.parse_analysis(response)
 
-		If you determine that the email is not a private jet charter request, respond with:
-		{{
-			"is_charter_request": false
-		}}
+	async def analyze_many(self, email_bodies: List[str]) -> List[Any]:
+		"""
+		Analyze several emails concurrently.
 
-		<examples>
-		Here's an example of what a private jet charter request looks like:
-		
-		{example_client_request_email}
+		Emails that normalize to the same body (resends, duplicate deliveries) are only analyzed
+		once, the analysis cache alone can't catch them when they arrive in the same batch.
 
-		Here's what I would expect the completion to be:
+		Returns:
+			The analyses in the same order as email_bodies, with the raised exception in place of any that failed
+		"""
+		unique_bodies = {}
+		for body in email_bodies:
+			unique_bodies.setdefault(analysis_cache_key(body), body)
 
-		{self.example_client_completion}
+		analyses = await asyncio.gather(
+			*[self.analyze_incoming_email_async(body) for body in unique_bodies.values()],
+			return_exceptions=True
+		)
+		analysis_by_key = dict(zip(unique_bodies, analyses))
+		return [analysis_by_key[analysis_cache_key(body)] for body in email_bodies]
 
-		Here's another example of what a private jet charter request looks like:
+	def analyze_batch(self, email_bodies: List[str]) -> List[Any]:
+		"""Run analyze_many on the shared OpenAI event loop from synchronous code"""
+		return openai_client.run(self.analyze_many(email_bodies))
 
-		{example_client_request_email_2}
+	def looks_like_charter(self, email_body: str) -> bool:
+		"""Cheap keyword prefilter, False means the email is certainly not a charter request"""
+		return CHARTER_HINTS.search(email_body) is not None
 
-		Here's what I would expect the completion to be:
+	def build_analysis_messages(self, email_body: str) -> List[Dict[str, str]]:
+		# Only the email itself varies, the instructions and examples stay an identical prompt prefix
+		return [
+			{"role": "system", "content": self._SYSTEM_PROMPT},
+			{"role": "user", "content": f"<content>\n{email_body}\n</content>"}
+		]
 
-		{self.example_client_completion_2}
-		</examples>
-		
-		<content>
-		{email_body}
-		</content>
+	def parse_analysis(self, response) -> Dict[str, Any]:
+		"""
+		Raises ValueError when the completion is not a JSON object, so a bad completion is
+		reported as a failed email and not mistaken for an email that was never analyzed
 		"""
-		
-		response = self.client.chat.completions.create(
-			model="gpt-4o-mini",
-			messages=[
-				{"role": "system", "content": "You are an AI assistant that analyzes emails for private jet charter requests."},
-				{"role": "user", "content": prompt}
-			],
-			response_format={ "type": "json_object" }
-		)
-		
 		try:
-			return json.loads(response.choices[0].message.content)
+			analysis = orjson.loads(response.choices[0].message.content)
 		except Exception as e:
-			print(e)
+			raise ValueError(f"Could not parse the email analysis: {str(e)}") from e
+
+		if not isinstance(analysis, dict):
+			raise ValueError(f"Expected the email analysis to be a JSON object, got {type(analysis).__name__}")
+		return analysis
 
 	def build_email(self, flight_info: Dict[str, Any]) -> Dict[str, Any]:
-		routes, dates, body_dates = self.parse_flight_dates(flight_info["flights"])
+		flights = flight_info["flights"]
+		routes, dates, body_dates = self.parse_flight_dates(FlightLegs.from_flights(flights))
 
-		subject = self.build_subject(routes, dates, flight_info["flights"][0]["aircraft_size"])
 		#  TODO: This is just using the first flight in the list - we need to be smarter about this
-		body = self.build_body(routes, body_dates, flight_info["flights"][0]["passengers"])
+		first_flight = flights[0]
+		subject = self.build_subject(routes, dates, first_flight["aircraft_size"])
+		body = self.build_body(routes, body_dates, first_flight["passengers"])
 
 		return {
 			"subject": subject,
 			"body": body
 		}
 
-	def parse_flight_dates(self, flights: List[Dict[str, Any]]) -> List[Tuple[str, any]]:
-		print([fl["travel_date"] for fl in flights])
-
-		parsed_flights = list(map(lambda flight: (
-			flight["origin"], 
-			flight["destination"], 
-			datetime.strptime(flight["travel_date"], "%Y-%m-%d %H:%M UTC")
-		), flights))
+	def parse_flight_dates(self, legs: FlightLegs) -> Tuple[str, str, str]:
+		if logging.getLogger().isEnabledFor(logging.DEBUG):
+			logging.debug(f"Formatting travel dates {legs.dates}")
 
 		fmt_string = '%m/%d/%Y'
 		body_fmt_string = '%m/%d/%Y %H:%M'
 
-		route = f"{parsed_flights[0][0]} - {parsed_flights[0][1]}"
-		dates = f"{parsed_flights[0][2].strftime(fmt_string)}"
-		body_dates = f"{parsed_flights[0][2].strftime(body_fmt_string)}"
+		route = " - ".join([legs.origins[0]] + legs.destinations)
+		dates = " - ".join(date.strftime(fmt_string) for date in legs.dates)
+		body_dates = " - ".join(date.strftime(body_fmt_string) for date in legs.dates)
 
-		for i in range(1, len(parsed_flights)):
-			route += f" - {parsed_flights[i][1]}"
-			dates += f" - {parsed_flights[i][2].strftime(fmt_string)}"
-			body_dates += f" - {parsed_flights[i][2].strftime(body_fmt_string)}"
-		
 		return (route, dates, body_dates)
 			
 
 	def validate_flight_plan(self, flight_info: Dict[str, Any]) -> bool:
-		last_date = None
-		last_destination = None
-		if len(flight_info["flights"]) == 0:
+		"""
+		A flight plan is valid when it has at least one flight, every travel date parses,
+		and each leg departs after the previous one from the airport the previous one lands at.
+		"""
+		try:
+			legs = FlightLegs.from_flights(flight_info.get("flights") or [])
+		except (KeyError, TypeError, ValueError, AttributeError):
+			# No flights, or a leg with a missing or malformed travel date
 			return False
 
-		if len(flight_info["flights"]) == 1:
-			return True
-			
-		return True
+		return all(
+			next_date > date and next_origin == destination
+			for destination, next_origin, date, next_date in zip(legs.destinations, legs.origins[1:], legs.dates, legs.dates[1:])
+		)
 		
 
 	def build_subject(self, route, dates, size) -> str:
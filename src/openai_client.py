@@ -0,0 +1,65 @@
+import asyncio
+import functools
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Coroutine
+
+if TYPE_CHECKING:
+	from openai import OpenAI, AsyncOpenAI
+
+# One pool of HTTP/2 connections to api.openai.com shared by every analyzer in the process
+MAX_KEEPALIVE_CONNECTIONS = 32
+MAX_CONNECTIONS = 64
+TIMEOUT = 30
+
+# openai and httpx are only imported when a client is first needed, they are slow to import
+# and the API endpoints that only read from Postgres never use them
+
+
+@functools.lru_cache(maxsize=1)
+def get_client() -> "OpenAI":
+	import httpx
+	from openai import OpenAI
+
+	limits = httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS, max_connections=MAX_CONNECTIONS)
+	return OpenAI(
+		api_key=os.getenv("OPENAI_API_KEY"),
+		http_client=httpx.Client(http2=True, limits=limits, timeout=TIMEOUT)
+	)
+
+
+@functools.lru_cache(maxsize=1)
+def get_async_client() -> "AsyncOpenAI":
+	import httpx
+	from openai import AsyncOpenAI
+
+	limits = httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS, max_connections=MAX_CONNECTIONS)
+	return AsyncOpenAI(
+		api_key=os.getenv("OPENAI_API_KEY"),
+		http_client=httpx.AsyncClient(http2=True, limits=limits, timeout=TIMEOUT)
+	)
+
+
+_event_loop = None
+# The first batches can arrive on several worker threads at once, lru_cache would let each start a loop
+_event_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+	"""
+	The event loop every async OpenAI call runs on.
+
+	The async client's connection pool is bound to the loop that first uses it, so it is
+	driven from this one background loop no matter which thread needs a completion.
+	"""
+	global _event_loop
+	with _event_loop_lock:
+		if _event_loop is None:
+			_event_loop = asyncio.new_event_loop()
+			threading.Thread(target=_event_loop.run_forever, name="openai-loop", daemon=True).start()
+		return _event_loop
+
+
+def run(coroutine: Coroutine[Any, Any, Any]) -> Any:
+	"""Run a coroutine on the shared OpenAI event loop and wait for its result"""
+	return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
@@ -1,29 +1,192 @@
+import base64
 import os
+import threading
 from datetime import datetime
 from contextlib import contextmanager
-from typing import Any, Generator, List, Optional, Dict
-from dotenv import load_dotenv
+from typing import Any, Generator, List, Optional, Dict, Tuple
 from psycopg import Cursor, Connection
+from psycopg.pq import TransactionStatus
 from psycopg.types.json import Jsonb
 from psycopg_pool import ConnectionPool
 from psycopg.rows import dict_row
+from cachetools import TTLCache
 import logging
+import bootstrap
+
+# Every query is built once here and sent with prepare=True, so each pooled connection
+# parses and plans it once and then only executes the prepared statement
+SQL_GET_USER_BY_EMAIL = 'SELECT id FROM "User" WHERE email = %s;'
+
+SQL_GET_VR_BY_USER_EMAIL = '''
+	SELECT * FROM "VendorResponse"
+	WHERE "userId" = %s AND "emailId" = %s
+	LIMIT 1;
+'''
+
+SQL_COUNT_VR = 'SELECT COUNT(*) FROM "VendorResponse" WHERE "userId" = %s;'
+
+# Listings only show a summary of each response, the request and response bodies and the
+# analysis are read by get_vendor_response_detail when a single response is opened
+VR_SUMMARY_COLUMNS = ', '.join(f'"{column}"' for column in [
+	"id",
+	"emailId",
+	"responseSubject",
+	"createdAt",
+	"updatedAt",
+	"radius",
+	"planeSize",
+	"numPassengers"
+])
+
+SQL_GET_VR_DETAIL = '''
+	SELECT * FROM "VendorResponse"
+	WHERE "userId" = %s AND "id" = %s
+	LIMIT 1;
+'''
+
+# "id" breaks ties between responses created at the same instant so pages never overlap.
+# Pages after the first are read by keyset on ("createdAt", "id"). That is only served straight from
+# an index, instead of scanning and discarding OFFSET rows, when the ("userId", "createdAt", "id")
+# index from the README exists
+SQL_PAGE_VR = {
+	'asc': f'SELECT {VR_SUMMARY_COLUMNS} FROM "VendorResponse" WHERE "userId" = %s ORDER BY "createdAt" ASC, "id" ASC LIMIT %s OFFSET %s;',
+	'desc': f'SELECT {VR_SUMMARY_COLUMNS} FROM "VendorResponse" WHERE "userId" = %s ORDER BY "createdAt" DESC, "id" DESC LIMIT %s OFFSET %s;',
+}
+
+SQL_PAGE_VR_AFTER = {
+	'asc': f'''
+		SELECT {VR_SUMMARY_COLUMNS} FROM "VendorResponse"
+		WHERE "userId" = %s AND ("createdAt", "id") > (%s, %s)
+		ORDER BY "createdAt" ASC, "id" ASC
+		LIMIT %s;
+	''',
+	'desc': f'''
+		SELECT {VR_SUMMARY_COLUMNS} FROM "VendorResponse"
+		WHERE "userId" = %s AND ("createdAt", "id") < (%s, %s)
+		ORDER BY "createdAt" DESC, "id" DESC
+		LIMIT %s;
+	''',
+}
+
+# Write a vendor response for the user with user_email, updating the user's existing response
+# to the same email instead of inserting a second one, so a redelivered email rewrites its row.
+# Returns nothing when no user matches.
+# ON CONFLICT would need a unique index on ("userId", "emailId"), which the schema doesn't guarantee
+SQL_UPSERT_VR_FOR_EMAIL = '''
+	WITH u AS (
+		SELECT id FROM "User" WHERE email = %(user_email)s
+	),
+	updated AS (
+		UPDATE "VendorResponse"
+		SET
+			"vendorEmails" = %(vendor_emails)s,
+			"requestBody" = %(request_body)s,
+			"responseBody" = %(generated_body)s,
+			"responseSubject" = %(subject)s,
+			"updatedAt" = %(updated_at)s,
+			"emailAnalysis" = %(email_analysis)s,
+			"radius" = %(radius)s,
+			"planeSize" = %(plane_size)s,
+			"numPassengers" = %(number_of_passengers)s
+		WHERE "userId" IN (SELECT id FROM u) AND "emailId" = %(email_id)s
+		RETURNING id, "userId"
+	),
+	inserted AS (
+		INSERT INTO "VendorResponse" (
+			"userId",
+			"emailId", 
+			"vendorEmails", 
+			"requestBody", 
+			"responseBody", 
+			"responseSubject",
+			"updatedAt",
+			"emailAnalysis",
+			"radius",
+			"planeSize",
+			"numPassengers"
+		)
+		SELECT
+			u.id,
+			%(email_id)s,
+			%(vendor_emails)s,
+			%(request_body)s,
+			%(generated_body)s,
+			%(subject)s,
+			%(updated_at)s,
+			%(email_analysis)s,
+			%(radius)s,
+			%(plane_size)s,
+			%(number_of_passengers)s
+		FROM u
+		WHERE NOT EXISTS (SELECT 1 FROM updated)
+		RETURNING id, "userId"
+	)
+	SELECT id, "userId" FROM updated
+	UNION ALL
+	SELECT id, "userId" FROM inserted;
+'''
+
+SQL_UPDATE_VR_SET = '''
+	UPDATE "VendorResponse"
+	SET
+		"vendorEmails" = COALESCE(%s, "vendorEmails"),
+		"requestBody" = COALESCE(%s, "requestBody"),
+		"responseBody" = COALESCE(%s, "responseBody"),
+		"responseSubject" = COALESCE(%s, "responseSubject"),
+		"updatedAt" = %s,
+		"emailAnalysis" = COALESCE(%s, "emailAnalysis"),
+		"radius" = COALESCE(%s, "radius"),
+		"planeSize" = COALESCE(%s, "planeSize"),
+		"numPassengers" = COALESCE(%s, "numPassengers")
+	WHERE "userId" = %s AND "emailId" = %s
+'''
+SQL_UPDATE_VR = SQL_UPDATE_VR_SET + '\tRETURNING id;'
+# Hands back the whole updated row, so callers showing it don't need to read it again
+SQL_UPDATE_VR_RETURNING_ROW = SQL_UPDATE_VR_SET + '\tRETURNING *;'
+
+
+def encode_page_cursor(created_at: datetime, response_id: Any) -> str:
+	"""Encode the position after a vendor response as an opaque, URL safe page cursor"""
+	return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{response_id}".encode()).decode()
+
+
+def decode_page_cursor(cursor: str) -> Tuple[datetime, str]:
+	"""Raises ValueError if the cursor was not produced by encode_page_cursor"""
+	created_at, response_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+	return datetime.fromisoformat(created_at), response_id
 
 class PostgresClient:
+	# The dashboard polls the same pages until a new vendor response is written, which clears them early
+	VendorResponsesCacheTTL = 10
+
 	def __init__(self):
-		load_dotenv()
+		bootstrap.load_env()
 		if os.getenv('DATABASE_URL') is not None:
 			conninfo = os.getenv('DATABASE_URL')
 		else: 
 			conninfo = f"dbname={os.getenv('DB_NAME')} user={os.getenv('DB_USER')} password={os.getenv('DB_PASSWORD')} host={os.getenv('DB_HOST')} port={os.getenv('DB_PORT')}"
+		# Every consumer worker can hold a connection at once, leave room for the API on top of them
+		workers = int(os.getenv('CONSUMER_WORKERS', 4))
 		# Configure the connection pool with specific settings
 		self.pool = ConnectionPool(
 			conninfo,
-			min_size=1,  # Minimum number of connections to maintain
-			max_size=10,  # Maximum number of connections in the pool
+			min_size=int(os.getenv('DB_POOL_MIN', 4)),  # Minimum number of connections kept open and warm
+			max_size=int(os.getenv('DB_POOL_MAX', max(10, workers + 2))),  # Maximum number of connections in the pool
 			timeout=30,   # Connection timeout in seconds
-			check=lambda conn: conn.execute("SELECT 1")  # Health check query
+			max_idle=300,  # Close connections above min_size after 5 minutes unused
+			max_lifetime=1800,  # Recycle connections every 30 minutes
+			num_workers=3,  # Background threads opening new connections
+			# No per-checkout check query, it doubled the roundtrips of every statement. Broken
+			# connections are discarded when returned to the pool and max_idle/max_lifetime
+			# recycle the rest
+			open=True
 		)
+		# Fail at startup rather than on the first request if the database can't be reached
+		self.pool.wait(timeout=30)
+		self.vendor_responses_cache = TTLCache(maxsize=10_000, ttl=self.VendorResponsesCacheTTL)
+		self.vendor_responses_lock = threading.Lock()
+		# Bumped on every write for the user, cached pages keyed by an older version are never read again
+		self.vendor_responses_versions: Dict[str, int] = {}
 
 	@contextmanager
 	def get_cursor(self, commit=False):
@@ -36,13 +199,13 @@ class PostgresClient:
 				if commit:
 					conn.commit()
 			except Exception as e:
-				if conn:
-					conn.rollback()
 				logging.error(f"Database error: {str(e)}")
 				raise
 			finally:
-				conn.rollback()
 				cursor.close()
+				# Only end a transaction that is still open, after a commit there is nothing to roll back
+				if conn.info.transaction_status != TransactionStatus.IDLE:
+					conn.rollback()
 		finally:
 			if conn:
 				self.pool.putconn(conn)
@@ -60,6 +223,15 @@ class PostgresClient:
 			if conn:
 				self.pool.putconn(conn)
 
+	def pool_stats(self) -> Dict[str, int]:
+		"""Connection pool counters, e.g. pool_size, pool_available and requests_waiting"""
+		return self.pool.get_stats()
+
+	def ping(self):
+		"""Run a trivial query on a pooled connection to check the database is reachable"""
+		with self.get_connection() as conn:
+			conn.execute("SELECT 1")
+
 	def get_user_id_by_email(self, email: str) -> Optional[str]:
 		"""
 		Get a user's ID by their email address.
@@ -72,9 +244,7 @@ class PostgresClient:
 		"""
 		try:
 			with self.get_cursor() as cur:
-				cur.execute("""
-					SELECT id FROM "User" WHERE email = %s;
-				""", (email,))
+				cur.execute(SQL_GET_USER_BY_EMAIL, (email,), prepare=True)
 				
 				result = cur.fetchone()
 				return result['id'] if result else None
@@ -96,7 +266,7 @@ class PostgresClient:
 		number_of_passengers: int
 	) -> str:
 		"""
-		Write a new vendor response to the database.
+		Write a vendor response to the database, replacing the user's existing response to the same email.
 		
 		Args:
 			email_id: The ID of the email this response is associated with
@@ -104,80 +274,174 @@ class PostgresClient:
 			generated_body: The generated body text of the response
 			subject: The subject line of the response
 		Returns:
-			str: The ID of the newly created vendor response
+			str: The ID of the written vendor response
 		"""
+		params = self._vendor_response_params(
+			user_email=user_email,
+			request_body=request_body,
+			email_id=email_id,
+			vendor_emails=vendor_emails,
+			generated_body=generated_body,
+			subject=subject,
+			email_analysis=email_analysis,
+			radius=radius,
+			plane_size=plane_size,
+			number_of_passengers=number_of_passengers
+		)
+
 		try:
-			# First get the user ID
-			user_id = self.get_user_id_by_email(user_email)
-			if not user_id:
-				raise ValueError(f"User with email {user_email} not found")
-				
+			# The user is looked up by email in the same statement as the write
 			with self.get_cursor(commit=True) as cur:
-				cur.execute("""
-					INSERT INTO "VendorResponse" (
-						"userId",
-						"emailId", 
-						"vendorEmails", 
-						"requestBody", 
-						"responseBody", 
-						"responseSubject",
-						"updatedAt",
-						"emailAnalysis",
-						"radius",
-						"planeSize",
-						"numPassengers"
-					) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-					RETURNING id;
-				""", (
-					user_id,
-					email_id,
-					vendor_emails,
-					request_body,
-					generated_body,
-					subject,
-					datetime.now(),
-					Jsonb(email_analysis),
-					radius,
-					plane_size,
-					number_of_passengers
-				))
+				cur.execute(SQL_UPSERT_VR_FOR_EMAIL, params, prepare=True)
 				
 				result = cur.fetchone()
-				return result['id']  # Using dict_row, so we can access by column name
+				if result is None:
+					# Nothing was written because no user has this email
+					raise ValueError(f"User with email {user_email} not found")
+			self.invalidate_vendor_responses(result['userId'])
+			return result['id']  # Using dict_row, so we can access by column name
 		except Exception as e:
 			logging.error(f"Error writing vendor response: {str(e)}")
 			raise
 
+	def write_vendor_responses_bulk(self, rows: List[Dict[str, Any]]) -> List[Optional[str]]:
+		"""
+		Write several vendor responses like write_vendor_response, in one transaction and one roundtrip.
+
+		Args:
+			rows: The keyword arguments of write_vendor_response, one dict per response
+
+		Returns:
+			List[Optional[str]]: The ID of each written vendor response in the order of rows,
+			None where no user has the row's user_email
+		"""
+		now = datetime.now()
+		params = [self._vendor_response_params(**row, updated_at=now) for row in rows]
+
+		try:
+			with self.get_cursor(commit=True) as cur:
+				# executemany pipelines the writes, with returning=True each one leaves a result set
+				cur.executemany(SQL_UPSERT_VR_FOR_EMAIL, params, returning=True)
+				results = []
+				while True:
+					results.append(cur.fetchone())
+					if not cur.nextset():
+						break
+		except Exception as e:
+			logging.error(f"Error writing {len(rows)} vendor responses: {str(e)}")
+			raise
+
+		for row, result in zip(rows, results):
+			if result is not None:
+				self.invalidate_vendor_responses(result['userId'])
+		return [result['id'] if result is not None else None for result in results]
+
+	def _vendor_response_params(
+		self,
+		user_email: str,
+		request_body: Optional[str],
+		email_id: str,
+		vendor_emails: Optional[List[str]],
+		generated_body: Optional[str],
+		subject: Optional[str],
+		email_analysis: Dict[str, Any],
+		radius: int,
+		plane_size: str,
+		number_of_passengers: int,
+		updated_at: Optional[datetime] = None
+	) -> Dict[str, Any]:
+		return {
+			"user_email": user_email,
+			"email_id": email_id,
+			"vendor_emails": vendor_emails,
+			"request_body": request_body,
+			"generated_body": generated_body,
+			"subject": subject,
+			"updated_at": updated_at or datetime.now(),
+			"email_analysis": Jsonb(email_analysis),
+			"radius": radius,
+			"plane_size": plane_size,
+			"number_of_passengers": number_of_passengers
+		}
+
+	def invalidate_vendor_responses(self, user_id: str):
+		"""Make every cached page of a user's vendor responses stale, they age out of the cache on their own"""
+		with self.vendor_responses_lock:
+			self.vendor_responses_versions[user_id] = self.vendor_responses_versions.get(user_id, 0) + 1
+
 	def get_vendor_responses_for_user(
 		self,
 		user_id: str,
 		page: int = 1,
 		page_size: int = 10,
-		sort_order: str = 'desc'
+		sort_order: str = 'desc',
+		cursor: Optional[str] = None
+	) -> Dict[str, Any]:
+		"""
+		Get paginated vendor responses for a given user ID, served from a short lived cache.
+
+		See _query_vendor_responses_for_user for the arguments and result.
+		"""
+		with self.vendor_responses_lock:
+			key = (user_id, self.vendor_responses_versions.get(user_id, 0), page, page_size, sort_order.lower(), cursor)
+			cached = self.vendor_responses_cache.get(key)
+		if cached is not None:
+			return cached
+
+		result = self._query_vendor_responses_for_user(user_id, page, page_size, sort_order, cursor)
+		with self.vendor_responses_lock:
+			self.vendor_responses_cache[key] = result
+		return result
+
+	def _query_vendor_responses_for_user(
+		self,
+		user_id: str,
+		page: int,
+		page_size: int,
+		sort_order: str,
+		cursor: Optional[str]
 	) -> Dict[str, Any]:
 		"""
 		Get paginated vendor responses for a given user ID.
+
+		Without a cursor the requested page is counted and read by offset. With a cursor the
+		page after it is read by keyset and page, total and total_pages are not computed.
 		
 		Args:
 			user_id: The ID of the user whose responses to fetch.
-			page: The page number to retrieve (1-indexed).
+			page: The page number to retrieve (1-indexed), ignored when a cursor is given.
 			page_size: The number of responses per page.
 			sort_order: The order to sort responses ('asc' or 'desc').
+			cursor: The next_cursor of the previous page.
 		
 		Returns:
-			A dictionary containing the list of responses, total count, page number, and total pages.
+			A dictionary containing the list of responses (summary columns only), total count,
+			page number, total pages, and the cursor of the next page (None on the last page).
 		"""
+		# Unknown sort orders fall back to DESC
+		sort_order = sort_order.lower() if sort_order.lower() in SQL_PAGE_VR else 'desc'
 		try:
 			with self.get_cursor() as cur:
+				if cursor is not None:
+					created_at, response_id = decode_page_cursor(cursor)
+					cur.execute(SQL_PAGE_VR_AFTER[sort_order], (user_id, created_at, response_id, page_size), prepare=True)
+					responses = cur.fetchall()
+
+					return {
+						"responses": responses,
+						"total": None,
+						"page": None,
+						"total_pages": None,
+						"next_cursor": self._next_page_cursor(responses, page_size)
+					}
+
 				# Count total responses for the user
-				cur.execute('''
-					SELECT COUNT(*) FROM "VendorResponse" WHERE "userId" = %s;
-				''', (user_id,))
+				cur.execute(SQL_COUNT_VR, (user_id,), prepare=True)
 				total_count_result = cur.fetchone()
 				total_count = total_count_result['count'] if total_count_result else 0
 
 				if total_count == 0:
-					return {"responses": [], "total": 0, "page": page, "total_pages": 0}
+					return {"responses": [], "total": 0, "page": page, "total_pages": 0, "next_cursor": None}
 
 				# Calculate offset and total pages
 				offset = (page - 1) * page_size
@@ -187,38 +451,31 @@ class PostgresClient:
 				if page < 1 or page > total_pages:
 					raise ValueError("Invalid page number")
 
-				# Determine sort direction safely
-				if sort_order.lower() == 'asc':
-					sort_clause = 'ORDER BY "createdAt" ASC'
-				else:
-					sort_clause = 'ORDER BY "createdAt" DESC' # Default to DESC
-
-				# Fetch paginated responses using safe parameterization
-				# Build the query string safely, ensuring %s placeholders are literal
-				query = (
-					'SELECT * FROM "VendorResponse" '
-					'WHERE "userId" = %s '
-					+ sort_clause + # Inject the validated sort clause
-					' LIMIT %s OFFSET %s;'
-				)
-				
-				cur.execute(query, (user_id, page_size, offset))
+				cur.execute(SQL_PAGE_VR[sort_order], (user_id, page_size, offset), prepare=True)
 				responses = cur.fetchall()
 
 				return {
 					"responses": responses,
 					"total": total_count,
 					"page": page,
-					"total_pages": total_pages
+					"total_pages": total_pages,
+					"next_cursor": self._next_page_cursor(responses, page_size)
 				}
 		except ValueError as ve:
 			logging.warning(f"Invalid request parameters: {str(ve)}")
-			# Return an empty list for invalid page numbers, consistent with API expectations
-			return {"responses": [], "total": total_count if 'total_count' in locals() else 0, "page": page, "total_pages": total_pages if 'total_pages' in locals() else 0}
+			# Return an empty list for invalid page numbers or cursors, consistent with API expectations
+			return {"responses": [], "total": total_count if 'total_count' in locals() else 0, "page": page, "total_pages": total_pages if 'total_pages' in locals() else 0, "next_cursor": None}
 		except Exception as e:
 			logging.error(f"Error getting paginated vendor responses for user {user_id}: {str(e)}")
 			raise
 
+	def _next_page_cursor(self, responses: List[Dict[str, Any]], page_size: int) -> Optional[str]:
+		# A short page is the last one
+		if len(responses) < page_size:
+			return None
+		last = responses[-1]
+		return encode_page_cursor(last["createdAt"], last["id"])
+
 	def get_vendor_response_by_user_and_email(self, user_id: str, email_id: str) -> Optional[Dict]:
 		"""
 		Get a single vendor response for a given user ID and email ID.
@@ -232,17 +489,32 @@ class PostgresClient:
 		"""
 		try:
 			with self.get_cursor() as cur:
-				cur.execute('''
-					SELECT * FROM "VendorResponse"
-					WHERE "userId" = %s AND "emailId" = %s
-					LIMIT 1;
-				''', (user_id, email_id))
+				cur.execute(SQL_GET_VR_BY_USER_EMAIL, (user_id, email_id), prepare=True)
 				result = cur.fetchone()
 				return result if result else None
 		except Exception as e:
 				logging.error(f"Error getting vendor response for user {user_id} and email_id {email_id}: {str(e)}")
 				raise
 
+	def get_vendor_response_detail(self, user_id: str, response_id: str) -> Optional[Dict]:
+		"""
+		Get every column of a single vendor response, for when one response from a listing is opened.
+		
+		Args:
+			user_id: The ID of the user the response belongs to
+			response_id: The ID of the vendor response
+		
+		Returns:
+			A dictionary representing the vendor response, or None if not found
+		"""
+		try:
+			with self.get_cursor() as cur:
+				cur.execute(SQL_GET_VR_DETAIL, (user_id, response_id), prepare=True)
+				return cur.fetchone()
+		except Exception as e:
+				logging.error(f"Error getting vendor response {response_id} for user {user_id}: {str(e)}")
+				raise
+
 	def update_vendor_response(
 		self,
 		user_id: str,
@@ -262,35 +534,63 @@ class PostgresClient:
 		"""
 		try:
 			with self.get_cursor(commit=True) as cur:
-				cur.execute('''
-					UPDATE "VendorResponse"
-					SET
-						"vendorEmails" = COALESCE(%s, "vendorEmails"),
-						"requestBody" = COALESCE(%s, "requestBody"),
-						"responseBody" = COALESCE(%s, "responseBody"),
-						"responseSubject" = COALESCE(%s, "responseSubject"),
-						"updatedAt" = %s,
-						"emailAnalysis" = COALESCE(%s, "emailAnalysis"),
-						"radius" = COALESCE(%s, "radius"),
-						"planeSize" = COALESCE(%s, "planeSize"),
-						"numPassengers" = COALESCE(%s, "numPassengers")
-					WHERE "userId" = %s AND "emailId" = %s
-					RETURNING id;
-				''', (
-					vendor_emails,
-					request_body,
-					generated_body,
-					subject,
-					datetime.now(),
-					Jsonb(email_analysis) if email_analysis is not None else None,
-					radius,
-					plane_size,
-					number_of_passengers,
+				cur.execute(SQL_UPDATE_VR, self._update_vendor_response_params(
 					user_id,
-					email_id
-				))
+					email_id,
+					vendor_emails=vendor_emails,
+					request_body=request_body,
+					generated_body=generated_body,
+					subject=subject,
+					email_analysis=email_analysis,
+					radius=radius,
+					plane_size=plane_size,
+					number_of_passengers=number_of_passengers
+				), prepare=True)
 				result = cur.fetchone()
-				return result['id'] if result else None
+			self.invalidate_vendor_responses(user_id)
+			return result['id'] if result else None
+		except Exception as e:
+				logging.error(f"Error updating vendor response for user {user_id} and email_id {email_id}: {str(e)}")
+				raise
+
+	def update_and_get_vendor_response(self, user_id: str, email_id: str, **fields) -> Optional[Dict]:
+		"""
+		Update a vendor response like update_vendor_response and return the whole updated row.
+		Returns the updated vendor response, or None if not found.
+		"""
+		try:
+			with self.get_cursor(commit=True) as cur:
+				cur.execute(SQL_UPDATE_VR_RETURNING_ROW, self._update_vendor_response_params(user_id, email_id, **fields), prepare=True)
+				result = cur.fetchone()
+			self.invalidate_vendor_responses(user_id)
+			return result
 		except Exception as e:
 				logging.error(f"Error updating vendor response for user {user_id} and email_id {email_id}: {str(e)}")
-				raise
\ No newline at end of file
+				raise
+
+	def _update_vendor_response_params(
+		self,
+		user_id: str,
+		email_id: str,
+		vendor_emails: Optional[List[str]] = None,
+		request_body: Optional[str] = None,
+		generated_body: Optional[str] = None,
+		subject: Optional[str] = None,
+		email_analysis: Optional[Dict] = None,
+		radius: Optional[int] = None,
+		plane_size: Optional[str] = None,
+		number_of_passengers: Optional[int] = None
+	) -> tuple:
+		return (
+			vendor_emails,
+			request_body,
+			generated_body,
+			subject,
+			datetime.now(),
+			Jsonb(email_analysis) if email_analysis is not None else None,
+			radius,
+			plane_size,
+			number_of_passengers,
+			user_id,
+			email_id
+		)
\ No newline at end of file
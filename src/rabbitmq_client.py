@@ -1,10 +1,35 @@
 import pika
-import json
-from typing import Callable, Dict, Any, List
+import orjson
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from typing import Callable, Dict, Any, List, Optional, Sequence
+import functools
 import os
+import threading
 import time
 import logging
 
+# Publish properties never change for a given persistence flag and provider, so each
+# combination is built once and shared by every publish
+PERSISTENT_JSON_PROPERTIES = pika.BasicProperties(
+    delivery_mode=2,  # 2 = persistent, 1 = non-persistent
+    content_type='application/json'
+)
+TRANSIENT_PROPERTIES = None
+
+
+@functools.lru_cache(maxsize=None)
+def message_properties(persistent: bool, provider: Optional[str]) -> Optional[pika.BasicProperties]:
+    if not provider:
+        return PERSISTENT_JSON_PROPERTIES if persistent else TRANSIENT_PROPERTIES
+
+    # Tag the message with its provider so consumers can route it from the headers alone
+    headers = {RabbitMQClient.ProviderHeader: provider}
+    if persistent:
+        return pika.BasicProperties(delivery_mode=2, content_type='application/json', headers=headers)
+    return pika.BasicProperties(headers=headers)
+
+
 class RabbitMQClient:
     """
     This class is responsible for connecting to RabbitMQ and sending and receiving messages
@@ -15,11 +40,24 @@ class RabbitMQClient:
     VendorOutreachQueue = "vendor_outreach"
     EmailQueue = "email_queue"
 
+    # Message header naming the provider an email belongs to, so consumers can skip others without parsing
+    ProviderHeader = "provider"
+
+    Queues = (InternalErrorQueue, ManualInterventionQueue, VendorOutreachQueue, EmailQueue)
+
     def __init__(self, max_retries=5, retry_delay=5):
         self.connection = None
         self.channel = None
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        self._pending_confirms: Dict[int, str] = {}
+        self._publish_seq = 0
+        # Publishes the broker nacked since the last flush_confirms
+        self._nacked_publishes = 0
+        # Queues declared on the current connection, redeclaring a durable queue is a broker roundtrip
+        self._declared_queues = set()
+        # The thread driving the connection while consuming, pika connections are not thread safe
+        self._io_thread: Optional[int] = None
         self.connect()
     
     def connect(self):
@@ -43,6 +81,10 @@ class RabbitMQClient:
                 )
                 self.connection = pika.BlockingConnection(parameters)
                 self.channel = self.connection.channel()
+                self._enable_publisher_confirms()
+                self._declared_queues = set()
+                for queue_name in self.Queues:
+                    self._declare_queue(queue_name)
                 logging.info("Successfully connected to RabbitMQ")
                 return
             except Exception as e:
@@ -54,65 +96,335 @@ class RabbitMQClient:
                     logging.error("Max retries reached. Could not connect to RabbitMQ.")
                     raise
     
+    def _enable_publisher_confirms(self):
+        """
+        Put the channel in confirm mode without making every publish wait for its ack.
+
+        BlockingChannel.confirm_delivery blocks inside each basic_publish until the broker
+        confirms it, so the ack/nack callback is registered on the underlying channel instead
+        and outstanding delivery tags are only waited on in flush_confirms.
+        """
+        if self._pending_confirms:
+            logging.warning(f"Lost confirms for {len(self._pending_confirms)} messages after reconnecting")
+        self._pending_confirms = {}
+        self._publish_seq = 0
+        self._nacked_publishes = 0
+        # BlockingChannel has no public way to register a confirm callback without also blocking
+        # every publish, so this reaches into pika's private _impl (the underlying async Channel).
+        # Check it still exists when upgrading pika, pinned in requirements.txt
+        self.channel._impl.confirm_delivery(ack_nack_callback=self._on_publish_confirm)
+
+    def _declare_queue(self, queue_name: str):
+        if queue_name not in self._declared_queues:
+            self.channel.queue_declare(queue=queue_name, durable=True)
+            self._declared_queues.add(queue_name)
+
+    def _on_publish_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            tags = [tag for tag in self._pending_confirms if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+
+        for tag in tags:
+            queue_name = self._pending_confirms.pop(tag, None)
+            if isinstance(method, pika.spec.Basic.Nack):
+                logging.error(f"Message published to {queue_name} was nacked by the broker")
+                self._nacked_publishes += 1
+
+    def flush_confirms(self, timeout: float = 10) -> bool:
+        """
+        Wait until the broker has confirmed every message published so far.
+
+        Returns:
+            False if a message published since the last flush was nacked by the broker, or
+            some confirms did not arrive within timeout
+        """
+        deadline = time.monotonic() + timeout
+        while self._pending_confirms and time.monotonic() < deadline:
+            self.connection.process_data_events(time_limit=0.01)
+
+        nacked, self._nacked_publishes = self._nacked_publishes, 0
+        if self._pending_confirms:
+            logging.warning(f"{len(self._pending_confirms)} published messages were not confirmed within {timeout}s")
+            return False
+        return nacked == 0
+
+    def open_channel(self):
+        """
+        Open a new channel on the shared connection.
+
+        Consumers get their own channel so their QoS window and acks are independent of the
+        confirm-mode channel used for publishing. Channels are still bound to the thread
+        driving the connection, pika connections are not thread safe.
+        """
+        self.ensure_connection()
+        return self.connection.channel()
+
     def ensure_connection(self):
         """Ensure the connection is active, reconnect if necessary"""
         if self.connection is None or self.connection.is_closed:
             logging.warning("RabbitMQ connection is closed. Attempting to reconnect...")
             self.connect()
     
-    def consume_messages(self, queue_name: str, callback: Callable[[Dict[str, Any]], None]):
+    def _is_for_provider(self, properties, provider: Optional[str]) -> bool:
+        """Messages without a provider header are accepted by every consumer"""
+        if provider is None or properties is None or not properties.headers:
+            return True
+        return properties.headers.get(self.ProviderHeader, provider) == provider
+
+    def consume_messages(
+        self,
+        queue_name: str,
+        callback: Callable[[Dict[str, Any]], None],
+        prefetch_count: int = 64,
+        provider: Optional[str] = None
+    ):
+        """
+        Start consuming messages from the specified queue.
+
+        Messages are pushed by the broker (up to prefetch_count in flight) and each one is
+        acknowledged once the callback has returned. A message whose callback raised is
+        requeued once, and dropped if it fails again on redelivery. Bodies that are not valid
+        JSON are dropped straight away.
+        If provider is given, messages tagged for a different provider are acked and
+        dropped without being parsed.
+        """
         def callback_wrapper(ch, method, properties, body):
-            if body:
-                callback(json.loads(body))
-            else:
-                logging.warning("Received empty message")
+            try:
+                if not self._is_for_provider(properties, provider):
+                    logging.debug(f"Skipping message for provider {properties.headers.get(self.ProviderHeader)}")
+                elif body:
+                    callback(orjson.loads(body))
+                else:
+                    logging.warning("Received empty message")
+            except orjson.JSONDecodeError as e:
+                # Redelivering it would only fail again
+                logging.error(f"Dropping undecodable message from {queue_name}: {str(e)}")
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                return
+            except Exception as e:
+                # One more attempt covers transient failures, a message that fails twice is dropped
+                requeue = not method.redelivered
+                logging.error(f"Failed to process message from {queue_name}, {'requeueing' if requeue else 'dropping'} it: {str(e)}")
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=requeue)
+                return
+            ch.basic_ack(delivery_tag=method.delivery_tag)
 
-        """Start consuming messages from the specified queue"""
-        self.ensure_connection()
-        self.channel.queue_declare(queue=queue_name, durable=True)
-        self.channel.basic_consume(
+        channel = self.open_channel()
+        self._io_thread = threading.get_ident()
+        channel.queue_declare(queue=queue_name, durable=True)
+        channel.basic_qos(prefetch_count=prefetch_count)
+        channel.basic_consume(
             queue=queue_name,
             on_message_callback=callback_wrapper,
-            auto_ack=True
+            auto_ack=False
         )
         try:
-            self.channel.start_consuming()
+            channel.start_consuming()
         except pika.exceptions.AMQPConnectionError:
             logging.error("AMQP connection error. Attempting to reconnect...")
             self.connect()
             # Retry consuming
-            self.consume_messages(queue_name, callback)
+            self.consume_messages(queue_name, callback, prefetch_count, provider)
 
+    def consume_messages_batched(
+        self,
+        queue_name: str,
+        callback: Callable[[List[Dict[str, Any]]], None],
+        batch_size: int = 10,
+        batch_timeout_ms: int = 500,
+        executor: Optional[Executor] = None,
+        prefetch_count: Optional[int] = None,
+        provider: Optional[str] = None
+    ):
+        """
+        Consume messages from the specified queue in batches.
 
-    def send_message(self, queue_name: str, message: Dict[str, Any], persistent: bool = True):
-        self.ensure_connection()
-        # Declare the queue before publishing to ensure it exists
-        self.channel.queue_declare(queue=queue_name, durable=True)
-
-        # Set message properties based on persistence flag
-        properties = None
-        if persistent:
-            properties = pika.BasicProperties(
-                delivery_mode=2,  # 2 = persistent, 1 = non-persistent
-                content_type='application/json'
+        Deliveries are accumulated until either batch_size messages have arrived or
+        batch_timeout_ms has elapsed since the first message of the batch. The callback
+        is invoked with the decoded bodies and the whole batch is then acknowledged with
+        a single multi-ack on the last delivery tag.
+
+        Batches are only acked once every message published while processing them has been
+        confirmed by the broker, otherwise they are handled like a batch whose callback raised.
+
+        If an executor is given, batches are processed on it while this thread keeps servicing
+        the connection, and completed batches are acked in delivery order. prefetch_count
+        should then cover every batch that can be in flight at once.
+
+        A batch whose callback raises is nacked and requeued as a whole, or dropped if any of
+        its messages had already been redelivered. A delivery whose body
+        is not valid JSON is nacked on its own without requeueing and left out of its batch.
+
+        If provider is given, messages tagged for a different provider are acked with the
+        batch but never parsed or handed to the callback.
+        """
+        channel = self.open_channel()
+        self._io_thread = threading.get_ident()
+        channel.queue_declare(queue=queue_name, durable=True)
+        channel.basic_qos(prefetch_count=prefetch_count or batch_size)
+
+        batch_timeout = batch_timeout_ms / 1000
+        batch = []
+        delivered = 0
+        last_tag = None
+        # Whether any delivery acked with the batch has already been through a failed attempt
+        redelivered = False
+        started = 0.0
+        in_flight = OrderedDict()
+
+        def nack_batch(last_tag, redelivered, error):
+            # Every earlier delivery is already settled, so this only settles the failed batch.
+            # One more attempt covers transient failures, a batch that fails again is dropped
+            requeue = not redelivered
+            logging.error(f"Failed to process batch from {queue_name}, {'requeueing' if requeue else 'dropping'} it: {str(error)}")
+            channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=requeue)
+
+        def ack_batch(last_tag, redelivered):
+            # The error and manual intervention reports published for the batch must not be
+            # lost, so it is only acked once the broker has confirmed every one of them
+            if self.flush_confirms():
+                channel.basic_ack(delivery_tag=last_tag, multiple=True)
+            else:
+                nack_batch(last_tag, redelivered, RuntimeError("Messages published while processing it were not confirmed"))
+
+        def ack_completed():
+            last_done = None
+            done_redelivered = False
+            while in_flight:
+                tag, (future, redelivered) = next(iter(in_flight.items()))
+                if not future.done():
+                    break
+                in_flight.popitem(last=False)
+                error = future.exception()
+                if error is None:
+                    last_done = tag
+                    done_redelivered = done_redelivered or redelivered
+                    continue
+
+                if last_done is not None:
+                    ack_batch(last_done, done_redelivered)
+                    last_done = None
+                    done_redelivered = False
+                nack_batch(tag, redelivered, error)
+
+            if last_done is not None:
+                ack_batch(last_done, done_redelivered)
+
+        def dispatch(batch, last_tag, redelivered):
+            if executor is None:
+                try:
+                    if batch:
+                        callback(batch)
+                except Exception as e:
+                    nack_batch(last_tag, redelivered, e)
+                    return
+                ack_batch(last_tag, redelivered)
+                return
+
+            if batch:
+                future = executor.submit(callback, batch)
+            else:
+                # Nothing to process, but the ack still has to wait for the batches ahead of it
+                future = Future()
+                future.set_result(None)
+            in_flight[last_tag] = (future, redelivered)
+            connection = self.connection
+            future.add_done_callback(lambda _: connection.add_callback_threadsafe(ack_completed))
+
+        try:
+            for method, properties, body in channel.consume(queue_name, inactivity_timeout=batch_timeout):
+                if method is not None:
+                    if delivered == 0:
+                        started = time.monotonic()
+                    delivered += 1
+                    if not self._is_for_provider(properties, provider):
+                        logging.debug(f"Skipping message for provider {properties.headers.get(self.ProviderHeader)}")
+                        last_tag = method.delivery_tag
+                    elif body:
+                        try:
+                            batch.append(orjson.loads(body))
+                            last_tag = method.delivery_tag
+                            redelivered = redelivered or method.redelivered
+                        except orjson.JSONDecodeError as e:
+                            # Redelivering it would only fail again, settle it on its own and leave it out of the batch ack
+                            logging.error(f"Dropping undecodable message from {queue_name}: {str(e)}")
+                            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                    else:
+                        logging.warning("Received empty message")
+                        last_tag = method.delivery_tag
+
+                if delivered and (delivered >= batch_size or time.monotonic() - started >= batch_timeout):
+                    # A batch of only undecodable messages has nothing left to ack
+                    if last_tag is not None:
+                        dispatch(batch, last_tag, redelivered)
+                    batch = []
+                    delivered = 0
+                    last_tag = None
+                    redelivered = False
+        except pika.exceptions.AMQPConnectionError:
+            logging.error("AMQP connection error. Attempting to reconnect...")
+            self.connect()
+            # Unacked deliveries are redelivered by the broker once the old channel is gone
+            self.consume_messages_batched(queue_name, callback, batch_size, batch_timeout_ms, executor, prefetch_count, provider)
+
+    def send_message(
+        self,
+        queue_name: str,
+        message: Dict[str, Any],
+        persistent: bool = True,
+        provider: Optional[str] = None
+    ):
+        self.send_to_queues([queue_name], message, persistent, provider)
+
+    def send_to_queues(
+        self,
+        queue_names: Sequence[str],
+        message: Dict[str, Any],
+        persistent: bool = True,
+        provider: Optional[str] = None
+    ):
+        """
+        Publish the same message to several queues.
+
+        The message is serialized once and published to every queue back to back, their
+        confirms are then collected together by flush_confirms.
+        """
+        body = orjson.dumps(message)
+        if self._io_thread is not None and self._io_thread != threading.get_ident():
+            # Called from a worker thread, hand the publishes to the thread driving the connection
+            self.connection.add_callback_threadsafe(
+                functools.partial(self._publish, queue_names, body, persistent, provider)
             )
+            return
+        self._publish(queue_names, body, persistent, provider)
 
-        self.channel.basic_publish(
-            exchange='',
-            routing_key=queue_name,
-            body=json.dumps(message),
-            properties=properties
-        )
+    def _publish(self, queue_names: Sequence[str], body: bytes, persistent: bool, provider: Optional[str]):
+        self.ensure_connection()
+        properties = message_properties(persistent, provider)
+        for queue_name in queue_names:
+            # Declare the queue before the first publish to it to ensure it exists
+            self._declare_queue(queue_name)
+
+            self.channel.basic_publish(
+                exchange='',
+                routing_key=queue_name,
+                body=body,
+                properties=properties
+            )
+            # The confirm is collected asynchronously, see flush_confirms
+            self._publish_seq += 1
+            self._pending_confirms[self._publish_seq] = queue_name
 
-    def send_error_message(self, queues: List[str], message: Dict[str, Any], error_type: str, **kwargs):
+    def send_error_message(self, queues: Sequence[str], message: Dict[str, Any], error_type: str, **kwargs):
         response = {
             "error": error_type,
             "message": message,
             **kwargs
         }
 
-        for q in queues:
-            self.send_message(q, response)
+        self.send_to_queues(queues, response)
 
     
     def close(self):
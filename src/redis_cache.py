@@ -0,0 +1,63 @@
+import orjson
+import os
+import threading
+from typing import Any, Optional
+import logging
+
+import redis
+from cachetools import TLRUCache
+
+
+class RedisCache:
+	"""
+	This class is responsible for caching JSON values in Redis, fronted by a small in-process LRU.
+
+	Redis is optional - if REDIS_URL is not set only the in-process tier is used.
+	"""
+
+	def __init__(self, prefix: str, ttl: int, local_size: int = 1024):
+		self.prefix = prefix
+		self.ttl = ttl
+		# Values are kept serialized so every hit hands out a fresh copy, next to the ttl they were set with
+		self.local = TLRUCache(maxsize=local_size, ttu=lambda _key, value, now: now + value[1])
+		self.lock = threading.Lock()
+
+		redis_url = os.getenv('REDIS_URL')
+		self.client = redis.Redis.from_url(redis_url, decode_responses=True) if redis_url else None
+
+	def get(self, key: str) -> Optional[Any]:
+		"""
+		Look up a cached value.
+
+		Returns:
+			The cached value, or None on a miss
+		"""
+		with self.lock:
+			payload, _ = self.local.get(key, (None, None))
+
+		if payload is None and self.client is not None:
+			try:
+				with self.client.pipeline(transaction=False) as pipe:
+					payload, remaining = pipe.get(self.prefix + key).ttl(self.prefix + key).execute()
+			except redis.RedisError as e:
+				logging.warning(f"Redis get failed for {self.prefix}{key}: {str(e)}")
+				payload = None
+
+			if payload is not None:
+				with self.lock:
+					self.local[key] = (payload, remaining if remaining > 0 else self.ttl)
+
+		return orjson.loads(payload) if payload is not None else None
+
+	def set(self, key: str, value: Any, ttl: Optional[int] = None):
+		"""Cache a JSON serializable value in both tiers, for ttl seconds instead of the default if given"""
+		ttl = ttl or self.ttl
+		payload = orjson.dumps(value)
+		with self.lock:
+			self.local[key] = (payload, ttl)
+
+		if self.client is not None:
+			try:
+				self.client.setex(self.prefix + key, ttl, payload)
+			except redis.RedisError as e:
+				logging.warning(f"Redis set failed for {self.prefix}{key}: {str(e)}")
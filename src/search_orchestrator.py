@@ -1,5 +1,6 @@
-import pprint
-from typing import Dict, Any, Union
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple, Union
 
 
 from contracts import FlightUpdateRequest
@@ -7,6 +8,7 @@ from tools.flight_finder import FlightFinderClient
 from rabbitmq_client import RabbitMQClient
 from email_processor import EmailProcessor
 from postgres_client import PostgresClient
+from redis_cache import RedisCache
 
 import logging
 import traceback
@@ -15,33 +17,63 @@ class SearchOrchestrator:
 	"""
 	This class is responsible for orchestrating the search for vendor emails
 	"""
+	# Value of the provider header on the emails this orchestrator handles
+	Provider = "flightlistpro"
+
 	FlightPlanError = "FlightPlanError"
 	NoVendorEmailsFound = "NoVendorEmailsFound"
 	UnknownError = "UnknownError"
 
+	# Queues each kind of failure is reported to, built once instead of per failed email
+	ErrorQueues = (RabbitMQClient.InternalErrorQueue, RabbitMQClient.ManualInterventionQueue)
+	NoVendorsQueues = (RabbitMQClient.ManualInterventionQueue,)
+
+	# Analysis used for emails the keyword prefilter rules out
+	NotCharterRequest = {"is_charter_request": False}
+
+	# Search radii tried in order until one has vendors
+	SearchRadii = (0, 50, 100, 150, 200, 250)
+
+	# Vendor searches are shared between users asking for the same origin, size and passengers.
+	# Empty results are only kept briefly so a vendor that just listed shows up soon
+	SearchCacheTTL = 600
+	EmptySearchCacheTTL = 30
+
+	# Enough emails per batch to keep the OpenAI connections busy, without holding a lone email back for long
+	BatchSize = 16
+	BatchTimeoutMs = 100
+
 	def __init__(
 		self,
 		rabbitmq_client: RabbitMQClient,
 		email_processor: EmailProcessor,
 		flight_finder: FlightFinderClient,
-		postgres_client: PostgresClient
+		postgres_client: PostgresClient,
+		max_workers: Optional[int] = None
 	):
 		self.rabbitmq_client = rabbitmq_client
 		self.email_processor = email_processor
 		self.flight_finder = flight_finder
 		self.postgres_client = postgres_client
+		# Read here rather than as the default, so .env has been loaded by whichever entry point built us
+		self.max_workers = max_workers or int(os.getenv('CONSUMER_WORKERS', 4))
+		self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="email-worker")
+		self.search_cache = RedisCache(prefix="ff:", ttl=self.SearchCacheTTL)
 	
-	def process_email_external(self, message):
+	def process_email_external(self, message, analysis=None):
 		try:
-			self.process_email(message)
+			self.process_email(message, analysis)
 		except Exception as e:
-			logging.error(f"Error processing email: {e}")
-			self.rabbitmq_client.send_error_message(
-				queues= [self.rabbitmq_client.InternalErrorQueue, self.rabbitmq_client.ManualInterventionQueue],
-				message=message,
-				error_type=self.UnknownError, 
-				**{ "error": str(e), "stacktrace": traceback.format_exc() }
-			)
+			self.report_processing_error(message, e)
+
+	def report_processing_error(self, message, error: Exception):
+		logging.error(f"Error processing email: {error}")
+		self.rabbitmq_client.send_error_message(
+			queues=self.ErrorQueues,
+			message=message,
+			error_type=self.UnknownError, 
+			**{ "error": str(error), "stacktrace": "".join(traceback.format_exception(error)) }
+		)
 		
 
 
@@ -79,15 +111,16 @@ class SearchOrchestrator:
 		radius = request.search_radius or 0
 
 
-		print(flight_origin, num_passengers, [aircraft_size], radius)
+		logging.debug("Recomputing search for %s with %s passengers, size %s and radius %s", flight_origin, num_passengers, aircraft_size, radius)
 
-		vendor_emails = self.flight_finder.search(flight_origin, num_passengers, [aircraft_size], radius)
+		vendor_emails = self.cached_search(flight_origin, num_passengers, [aircraft_size], radius)
 
 		if len(vendor_emails) == 0:
 			logging.error(f"No vendor emails found for user {request.user_id} and email {request.message_id}")
 			return self.NoVendorEmailsFound
 		
-		pprint.pprint(flights)
+		if logging.getLogger().isEnabledFor(logging.DEBUG):
+			logging.debug("Updating flights %r", flights)
 		
 		updated_flights = [{
 			"origin": f.get('origin'),
@@ -104,7 +137,7 @@ class SearchOrchestrator:
 
 		email = self.email_processor.build_email(updated_analysis)
 
-		self.postgres_client.update_vendor_response(
+		response = self.postgres_client.update_and_get_vendor_response(
 			user_id=request.user_id,
 			email_id=request.message_id,
 			vendor_emails=vendor_emails,
@@ -116,18 +149,35 @@ class SearchOrchestrator:
 			number_of_passengers=num_passengers
 		)
 
-		response = self.postgres_client.get_vendor_response_by_user_and_email(request.user_id, request.message_id)
-
 		if not response:
-			logging.error(f"No vendor response found for user {request.user_id} and email {request.message_id} after response")
+			logging.error(f"No vendor response found for user {request.user_id} and email {request.message_id} after the update")
 			return self.UnknownError
 			
 
 		return response
 
 
-	def process_email(self, message):
-		"""Process a single email"""
+	def process_email(self, message, analysis=None):
+		"""
+		Process a single email
+
+		analysis may be passed in when the email was already analyzed as part of a batch,
+		in which case it can also be the exception raised by that analysis
+		"""
+		vendor_response = self.build_vendor_response(message, analysis)
+		if vendor_response is None:
+			return
+
+		self.postgres_client.write_vendor_response(**vendor_response)
+		return vendor_response["vendor_emails"]
+
+	def build_vendor_response(self, message, analysis=None) -> Optional[Dict[str, Any]]:
+		"""
+		Analyze an email and search for its vendors, without writing anything to the database
+
+		Returns:
+			The write_vendor_response arguments for the email, or None if there is nothing to write
+		"""
 		# Extract email content
 		"""
 		Here's the message structure
@@ -144,10 +194,19 @@ class SearchOrchestrator:
 		if email_content == "":
 			logging.info("No email content")
 			return
+
+		email_processor = self.email_processor
 		
-		# Analyze the email using LLM
-		logging.info("Analyzing email ...")
-		analysis = self.email_processor.analyze_incoming_email(email_content)
+		if isinstance(analysis, Exception):
+			raise analysis
+
+		if analysis is None:
+			if email_processor.looks_like_charter(email_content):
+				# Analyze the email using LLM
+				logging.info("Analyzing email ...")
+				analysis = email_processor.analyze_incoming_email(email_content)
+			else:
+				analysis = self.NotCharterRequest
 
 		# If it's not a jet charter request, don't process it
 		if not analysis.get('is_charter_request'):
@@ -155,47 +214,36 @@ class SearchOrchestrator:
 			return
 
 		logging.info("Validating flight dates ...")
-		if not self.email_processor.validate_flight_plan(analysis):           
+		if not email_processor.validate_flight_plan(analysis):           
 			#  This is so we can investigate the error later
 
 			# This is so our frontend can show the user the error, and let them manually intervene
 			self.rabbitmq_client.send_error_message(
-				queues= [self.rabbitmq_client.InternalErrorQueue, self.rabbitmq_client.ManualInterventionQueue],
+				queues=self.ErrorQueues,
 				message=message,
 				error_type=self.FlightPlanError,
 			)
 
-			print("Invalid flight responses - llm needs to get better at handling these")
+			logging.warning("Invalid flight plan - llm needs to get better at handling these")
 			return
 
+		email_id = message.get('email_id')
+
 		# This is only finding the vendor emails for the first flight
 		starting_flight = analysis["flights"][0]
+		origin = starting_flight["origin"]
+		passengers = starting_flight["passengers"]
+		aircraft_size = starting_flight["aircraft_size"]
 
 		logging.info("Searching for vendor emails ...")
 
-		radius = 0
-		max_radius = 250
-		radius_increment = 50
-		vendor_emails = []
-
-		while len(vendor_emails) == 0 and radius <= max_radius:
-			logging.info(f"Searching for vendor emails with radius {radius}...")
-			vendor_emails = self.flight_finder.search(
-				starting_flight["origin"], 
-				starting_flight["passengers"], 
-				[starting_flight["aircraft_size"]],
-				radius=radius
-			)
-			
-			if len(vendor_emails) == 0:
-				radius += radius_increment
-				logging.info(f"No results found, increasing radius to {radius}")
+		vendor_emails = self.search_nearest_vendors(origin, passengers, aircraft_size)
 
 		if len(vendor_emails) == 0:
-			response = { "error": self.NoVendorEmailsFound, "email_id": message.get('email_id'), "message": message }
+			response = { "error": self.NoVendorEmailsFound, "email_id": email_id, "message": message }
 
 			self.rabbitmq_client.send_error_message(
-				queues= [self.rabbitmq_client.ManualInterventionQueue],
+				queues=self.NoVendorsQueues,
 				message=response,
 				error_type=self.NoVendorEmailsFound
 			)
@@ -203,28 +251,133 @@ class SearchOrchestrator:
 			logging.info("No vendor emails found")
 
 		logging.info("Building email ...")
-		email = self.email_processor.build_email(analysis)
-
-		self.postgres_client.write_vendor_response(
-			user_email=message.get('user_email'),
-			request_body=email_content,
-			email_id=message.get('email_id'),
-			vendor_emails=vendor_emails,
-			generated_body=email["body"],
-			subject=email["subject"],
-			email_analysis=analysis,
-			radius=0,
-			plane_size=starting_flight["aircraft_size"],
-			number_of_passengers=starting_flight["passengers"]
-		)
+		email = email_processor.build_email(analysis)
+
+		return {
+			"user_email": message.get('user_email'),
+			"request_body": email_content,
+			"email_id": email_id,
+			"vendor_emails": vendor_emails,
+			"generated_body": email["body"],
+			"subject": email["subject"],
+			"email_analysis": analysis,
+			"radius": 0,
+			"plane_size": aircraft_size,
+			"number_of_passengers": passengers
+		}
+	
+	def cached_search(self, origin: str, passengers: int, aircraft_sizes: List[str], radius: int = 0) -> List[str]:
+		"""
+		FlightFinderClient.search behind the search cache
 
+		Failed searches raise before anything is cached, so an outage is never remembered as no vendors.
+		"""
+		# The analysis allows a null origin, it is still searched as before and only needs a key
+		key = f"{(origin or '').upper()}:{passengers}:{','.join(sorted(map(str, aircraft_sizes)))}:{radius}"
+		vendor_emails = self.search_cache.get(key)
+		if vendor_emails is not None:
+			return vendor_emails
+
+		vendor_emails = self.flight_finder.search(origin, passengers, aircraft_sizes, radius=radius)
+		self.search_cache.set(key, vendor_emails, ttl=None if vendor_emails else self.EmptySearchCacheTTL)
 		return vendor_emails
-		# Construct and send the response email
-		
-	
-	def consume_emails(self):
-		"""Start processing emails from the queue"""
-		self.rabbitmq_client.consume_messages(
-			queue_name= self.rabbitmq_client.EmailQueue,
-			callback=self.process_email_external
-		) 
\ No newline at end of file
+
+	def search_nearest_vendors(self, origin: str, passengers: int, aircraft_size: str) -> List[str]:
+		"""
+		Search the radii in SearchRadii in order and return the vendor emails of the first one with results
+
+		The radii can't be searched concurrently: Flight Finder keeps the current search in the
+		session, so searches on the one session cookie are serialized by the client anyway.
+		"""
+		for radius in self.SearchRadii:
+			logging.info(f"Searching for vendor emails with radius {radius}...")
+			vendor_emails = self.cached_search(
+				origin, 
+				passengers, 
+				[aircraft_size],
+				radius=radius
+			)
+			if vendor_emails:
+				return vendor_emails
+			logging.info(f"No results found with radius {radius}")
+		return []
+
+	def process_emails(self, messages: List[Dict[str, Any]]):
+		"""Process a batch of emails pulled from the queue"""
+		# Run the LLM analyses for the whole batch concurrently, the rest of the pipeline is per email.
+		# Emails the keyword prefilter rules out never reach the LLM
+		emails = []
+		for message in messages:
+			# Valid JSON is not necessarily an email, a bad body only fails itself and not the batch
+			if not isinstance(message, dict):
+				self.report_processing_error(message, TypeError(f"Expected an email object, got {type(message).__name__}"))
+			elif not isinstance(message.get('content', ''), str):
+				self.report_processing_error(message, TypeError(f"Expected the email content to be a string, got {type(message['content']).__name__}"))
+			else:
+				emails.append(message)
+
+		pending = []
+		analysis_by_message = {}
+		for message in emails:
+			content = message.get('content', '')
+			if content == "":
+				continue
+			if self.email_processor.looks_like_charter(content):
+				pending.append(message)
+			else:
+				analysis_by_message[id(message)] = self.NotCharterRequest
+
+		analyses = self.email_processor.analyze_batch([message['content'] for message in pending])
+		analysis_by_message.update({id(message): analysis for message, analysis in zip(pending, analyses)})
+
+		vendor_responses = []
+		for message in emails:
+			try:
+				vendor_response = self.build_vendor_response(message, analysis_by_message.get(id(message)))
+			except Exception as e:
+				self.report_processing_error(message, e)
+				continue
+			if vendor_response is not None:
+				vendor_responses.append((message, vendor_response))
+
+		self.write_vendor_responses(vendor_responses)
+
+	def write_vendor_responses(self, vendor_responses: List[Tuple[Dict[str, Any], Dict[str, Any]]]):
+		"""Write the (message, vendor response) pairs of a batch with a single bulk insert"""
+		if not vendor_responses:
+			return
+
+		try:
+			response_ids = self.postgres_client.write_vendor_responses_bulk([row for _, row in vendor_responses])
+		except Exception as e:
+			# Fall back to one write per email so a single bad row only fails its own email
+			logging.error(f"Bulk write of {len(vendor_responses)} vendor responses failed, writing them one by one: {e}")
+			for message, row in vendor_responses:
+				try:
+					self.postgres_client.write_vendor_response(**row)
+				except Exception as e:
+					self.report_processing_error(message, e)
+			return
+
+		for (message, row), response_id in zip(vendor_responses, response_ids):
+			if response_id is None:
+				self.report_processing_error(message, ValueError(f"User with email {row['user_email']} not found"))
+
+	def consume_emails(self, batch_size: int = BatchSize, batch_timeout_ms: int = BatchTimeoutMs):
+		"""
+		Start processing emails from the queue.
+
+		Emails are delivered in batches of up to batch_size (or whatever arrived within
+		batch_timeout_ms). Batches are processed concurrently on the worker pool and each
+		batch is acknowledged once all of its emails are processed.
+		"""
+		self.rabbitmq_client.consume_messages_batched(
+			queue_name=self.rabbitmq_client.EmailQueue,
+			callback=self.process_emails,
+			batch_size=batch_size,
+			batch_timeout_ms=batch_timeout_ms,
+			executor=self.executor,
+			# Enough unacked deliveries to keep every worker busy
+			prefetch_count=batch_size * self.max_workers,
+			provider=self.Provider
+		)
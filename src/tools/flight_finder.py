@@ -1,64 +1,118 @@
 from enum import Enum
+import orjson
 import logging
 import re
 from typing import Optional, Dict, Any, Union, List
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
-from bs4 import BeautifulSoup
-from functools import reduce
-
-flatmap = lambda f, xs: reduce(lambda acc, x: acc + f(x), xs, [])
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from selectolax.lexbor import LexborHTMLParser
+from cachetools import TTLCache
+
+# Vendor detail pages carry a plain mailto link, reading it off the raw bytes avoids parsing the page
+MAILTO = re.compile(rb'href\s*=\s*["\']mailto:([^"\'&]+)["\']', re.IGNORECASE)
+EMAIL_ADDRESS = re.compile(r"[^@\s]+@[^@\s]+")
+# Markup the HTML parser never reports links from, regex matches inside them are not trusted
+HIDDEN_BLOCKS = ((b"<!--", b"-->"), (b"<script", b"</script"))
+# Search result cells link to a vendor through an onclick="vendor_details(<id>)" handler.
+# The token is plain ASCII and survives JSON encoding untouched, so it is matched on the raw AJAX body
+VENDOR_ID = re.compile(rb'vendor_details\((\d+)\)')
+
+def visible_mailto(html: bytes, match: re.Match) -> Optional[str]:
+	"""The address of a MAILTO match, None when it is hidden markup, not UTF-8 or not an email address"""
+	lowered = html[:match.start()].lower()
+	for start, end in HIDDEN_BLOCKS:
+		if lowered.rfind(start) > lowered.rfind(end):
+			return None
+
+	try:
+		address = match.group(1).decode()
+	except UnicodeDecodeError:
+		return None
+	return address if EMAIL_ADDRESS.fullmatch(address) else None
 
 class FlightFinderClient:
 	CookieCi = "ci_session"
+	# Vendor detail pages are independent of each other and of the search state, so they are fetched in parallel
+	VendorDetailWorkers = 8
+	# The same vendors come back for most searches around an airport, their contact email rarely changes
+	VendorEmailCacheTTL = 3600
+	# Aircraft size names as the analysis prompt produces them, mapped to the site's category ids
+	JetSizes = {
+		"Ultra Long Range": 20,
+		"Heavy Jet": 1,
+		"Super Midsize Jet": 11,
+		"Midsize Jet": 9,
+		"Light Jet": 8,
+		"Very Light Jet": 14,
+		"Turbo Prop": 12,
+		"Piston Prop": 10
+	}
 
 	def __init__(self, base_url: Optional[str] = None):
 		self.base_url = base_url or os.getenv('FLIGHT_FINDER_BASE_URL', '')
 		self.ci_session = os.getenv('FLIGHT_FINDER_CI_SESSION')
 		self.session = requests.Session()  
+		# Room for every vendor detail worker to keep its own connection alive, the default pool only holds 10.
+		# These POSTs only read search results, so retrying them on a gateway error is safe
+		adapter = HTTPAdapter(
+			pool_connections=16,
+			pool_maxsize=32,
+			max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504], allowed_methods=["GET", "POST"])
+		)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+		# The site keeps the current search parameters in the session, so only one search can run at a time
+		self.search_lock = threading.Lock()
+		# Shared by every search so the worker threads are started once, not per search
+		self.vendor_detail_executor = ThreadPoolExecutor(max_workers=self.VendorDetailWorkers, thread_name_prefix="vendor-details")
+		self.vendor_email_cache = TTLCache(maxsize=2048, ttl=self.VendorEmailCacheTTL)
+		self.vendor_email_lock = threading.Lock()
 		# This is hardcoded for now, but we're going to need to get this from the login page
 		# There's a captcha on the login page that we need to solve, i don't want to deal with that right now
 		self.session.cookies.set(self.CookieCi, self.ci_session)
 
 	def get_aircraft_size(self, aircraft_size: str) -> Optional[int]:
-		print("aircraft_size", aircraft_size)
-		jetSizes = {
-			"Ultra Long Range": 20,
-			"Heavy Jet": 1,
-			"Super Midsize Jet": 11,
-			"Midsize Jet": 9,
-			"Light Jet": 8,
-			"Very Light Jet": 14,
-			"Turbo Prop": 12,
-			"Piston Prop": 10
-		}
-		print(jetSizes.get(aircraft_size))
-
-		if aircraft_size not in jetSizes:
-			return None  # Default to largest size if unknown
-
-		return jetSizes[aircraft_size]
+		"""The site's category id for an aircraft size, None when the size is unknown"""
+		return self.JetSizes.get(aircraft_size)
 
 	def search(self, airportCode: str, numPassengers: int, aircraft_sizes: List[str], radius: int = 0):
 		logging.info("Searching for vendor emails with code: %s and pax: %s", airportCode, numPassengers)
 
-		print(aircraft_sizes)
+		logging.debug("Searching with aircraft sizes %s", aircraft_sizes)
 		size_nums = [size for size in map(self.get_aircraft_size, aircraft_sizes) if size is not None]
 
-		if size_nums:
-			self.search_results(airportCode, pax=numPassengers, flight_sizes=size_nums, radius=radius)
-		else:
-			self.search_results(airportCode, pax=numPassengers, radius=radius)
+		with self.search_lock:
+			if size_nums:
+				self.search_results(airportCode, pax=numPassengers, flight_sizes=size_nums, radius=radius)
+			else:
+				self.search_results(airportCode, pax=numPassengers, radius=radius)
 
-		# This call is only relevant to set the correct params on the cookie
-		htmlResponse = self.search_results_ajax(start=0, length=400)['data']
+			# This call is only relevant to set the correct params on the cookie
+			resultsPage = self.search_results_ajax_content(start=0, length=400)
 		
-		vendorIds = list(set(map(lambda x: int(x), (flatmap(self.parse_search_results, htmlResponse)))))
+		# Only the vendor ids are needed from the results, so the JSON is never decoded
+		vendorIds = {int(vendorId) for vendorId in VENDOR_ID.findall(resultsPage)}
 
-		vendorEmails = list(set(map(self.extract_mailto, map(self.get_vendor_details, vendorIds))))
+		# Vendors without a mailto link have nobody to send the request to
+		vendorEmails = list({email for email in self.vendor_detail_executor.map(self.get_vendor_email, vendorIds) if email})
 
 		return vendorEmails
 
+	def get_vendor_email(self, vendorId: int) -> Optional[str]:
+		"""The vendor's mailto address, fetched from its detail page on a cache miss"""
+		with self.vendor_email_lock:
+			if vendorId in self.vendor_email_cache:
+				return self.vendor_email_cache[vendorId]
+
+		email = self.extract_mailto(self.get_vendor_details(vendorId))
+		with self.vendor_email_lock:
+			self.vendor_email_cache[vendorId] = email
+		return email
+
 	def get_vendor_details(self, vendorId: int):
 		url = f"{self.base_url}/pages_view/vendor_details"
 
@@ -69,25 +123,25 @@ class FlightFinderClient:
 		try:
 			response = self.session.post(url, data=form_data)
 			response.raise_for_status()
-			return response.text
+			return response.content
 		except requests.exceptions.RequestException as e:
 			raise Exception(f"Failed to make vendor details request: {str(e)}")
 	
-	def extract_mailto(self, html_text: str) -> str:
-		soup = BeautifulSoup(html_text, 'html.parser')
-		if mailto_link := soup.find('a', href=lambda x: x and x.startswith('mailto:')):
-			return mailto_link['href'].replace('mailto:', '')
+	def extract_mailto(self, html: bytes) -> str:
+		# Anything the regex can't vouch for is left to the parser below
+		if (match := MAILTO.search(html)) and (address := visible_mailto(html, match)):
+			return address
+
+		# Pages with no mailto link at all are the common miss, there is no point building a tree for them
+		if b"mailto:" not in html:
+			return None
+
+		# Entity encoded, hidden or otherwise unusual links are left to the HTML parser
+		if mailto_link := LexborHTMLParser(html).css_first('a[href^="mailto:"]'):
+			return mailto_link.attributes['href'][len('mailto:'):]
 		
 		return None
 
-	def parse_search_results(self, html_list: list):
-		return list(filter(lambda x: x is not None, [self.extract_vendor_id(element) for element in html_list]))
-
-	def extract_vendor_id(self, html_element: str) -> str:
-		if match := re.search(r'vendor_details\((\d+)\)', f"{html_element}"):
-			return match.group(1)
-		return None
-
 	def search_results(
 		self,
 		code: str,
@@ -119,21 +173,20 @@ class FlightFinderClient:
 
 		url = f"{self.base_url}/search-results"
 		
-		form_data = {
-			"capability": capability,
-			"searchby": searchby,
-			"code": code,
-			"radius": radius,
-			"pax": pax,
-			"rdtype": rdtype,
-			"submit-user": submit_user
-		}
-
-		if flight_sizes:
-			form_data["category[]"] = flight_sizes
+		# Field pairs go to the encoder as they are, repeated category[] fields included
+		form_data = [
+			("capability", capability),
+			("searchby", searchby),
+			("code", code),
+			("radius", radius),
+			("pax", pax),
+			("rdtype", rdtype),
+			("submit-user", submit_user)
+		]
+		form_data += [("category[]", size) for size in flight_sizes or ()]
 
 		if yom_min:
-			form_data["yom_min"] = yom_min
+			form_data.append(("yom_min", yom_min))
 		
 		try:
 			response = self.session.post(url, data=form_data)
@@ -165,6 +218,10 @@ class FlightFinderClient:
 		Returns:
 			Dict containing the DataTables response
 		"""
+		return orjson.loads(self.search_results_ajax_content(start=start, length=length))
+
+	def search_results_ajax_content(self, start: int = 0, length: int = 1) -> bytes:
+		"""The undecoded JSON body of a search_results_ajax request"""
 		url = f"{self.base_url}/search-results-ajax"
 		
 		# Construct the form data
@@ -179,7 +236,7 @@ class FlightFinderClient:
 		try:
 			response = self.session.post(url, data=form_data)
 			response.raise_for_status()
-			return response.json()
+			return response.content
 		except requests.exceptions.RequestException as e:
 			raise Exception(f"Failed to make AJAX search request: {str(e)}") 
 
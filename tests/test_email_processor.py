@@ -0,0 +1,20 @@
+from email_processor import analysis_cache_key, normalize_email_body
+
+
+def test_normalize_email_body_strips_the_trailing_footer():
+    body = "KDFW to KMSY on 2025-05-14, PAX: 3\n\nFlight Finder Exclusive - unsubscribe at any time"
+    assert normalize_email_body(body) == "KDFW to KMSY on 2025-05-14, PAX: 3"
+
+
+def test_normalize_email_body_keeps_content_after_an_early_marker():
+    banner = "Flight Finder Exclusive offers this week!\n"
+    first = banner + "Email: alice@example.com\nKDFW to KMSY on 2025-05-14, PAX: 3\n" + "x" * 600
+    second = banner + "Email: bob@example.com\nKDFW to KMSY on 2025-05-14, PAX: 3\n" + "x" * 600
+
+    assert "alice@example.com" in normalize_email_body(first)
+    assert analysis_cache_key(first) != analysis_cache_key(second)
+
+
+def test_normalize_email_body_cuts_at_the_last_marker():
+    body = "> Flight Finder Exclusive\nKDFW to KMSY, PAX: 3\nFlight Finder Exclusive footer"
+    assert normalize_email_body(body) == "> Flight Finder Exclusive KDFW to KMSY, PAX: 3"
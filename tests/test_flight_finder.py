@@ -0,0 +1,27 @@
+import pytest
+
+from tools.flight_finder import FlightFinderClient
+
+
+@pytest.fixture
+def client():
+    return FlightFinderClient(base_url="http://flight-finder.test")
+
+
+def test_extract_mailto_reads_plain_link(client):
+    assert client.extract_mailto(b'<a href="mailto:ops@vendor.test">Email</a>') == "ops@vendor.test"
+
+
+def test_extract_mailto_ignores_links_in_comments_and_scripts(client):
+    html = b'<!-- <a href="mailto:old@vendor.test"> --><script>"href=\'mailto:js@vendor.test\'"</script><p>No email</p>'
+    assert client.extract_mailto(html) is None
+
+
+def test_extract_mailto_prefers_the_visible_link(client):
+    html = b'<!-- <a href="mailto:old@vendor.test"> --><a href="mailto:ops@vendor.test">Email</a>'
+    assert client.extract_mailto(html) == "ops@vendor.test"
+
+
+def test_extract_mailto_does_not_raise_on_non_utf8_pages(client):
+    html = '<a href="mailto:josé@vendor.test">Email</a>'.encode("latin-1")
+    assert client.extract_mailto(html).endswith("@vendor.test")
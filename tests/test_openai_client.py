@@ -0,0 +1,20 @@
+import threading
+
+import openai_client
+
+
+def test_concurrent_first_calls_share_one_event_loop():
+    barrier = threading.Barrier(4)
+    loops = []
+
+    def get_loop():
+        barrier.wait()
+        loops.append(openai_client.get_event_loop())
+
+    threads = [threading.Thread(target=get_loop) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(map(id, loops))) == 1
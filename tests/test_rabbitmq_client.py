@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from rabbitmq_client import RabbitMQClient
+
+
+class FakeChannel:
+    """Just enough of a BlockingChannel to drive the consumers"""
+
+    def __init__(self, bodies, redelivered=False):
+        self.deliveries = [
+            (SimpleNamespace(delivery_tag=tag, redelivered=redelivered), None, body)
+            for tag, body in enumerate(bodies, start=1)
+        ]
+        self.acks = []
+        self.nacks = []
+
+    def queue_declare(self, queue, durable):
+        pass
+
+    def basic_qos(self, prefetch_count):
+        pass
+
+    def consume(self, queue_name, inactivity_timeout):
+        yield from self.deliveries
+
+    def basic_consume(self, queue, on_message_callback, auto_ack):
+        self.on_message = on_message_callback
+
+    def start_consuming(self):
+        for method, properties, body in self.deliveries:
+            self.on_message(self, method, properties, body)
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self.nacks.append((delivery_tag, multiple, requeue))
+
+
+def make_client(channel):
+    client = RabbitMQClient.__new__(RabbitMQClient)
+    client._pending_confirms = {}
+    client._nacked_publishes = 0
+    client.open_channel = lambda: channel
+    # Done callbacks run on the worker threads, run the ack marshalled back to the I/O thread inline
+    client.connection = SimpleNamespace(add_callback_threadsafe=lambda callback: callback())
+    return client
+
+
+def test_batched_consumer_drops_undecodable_message_and_acks_the_rest():
+    channel = FakeChannel([b'{"email_id": "1"}', b'not json', b'{"email_id": "3"}'])
+    batches = []
+
+    make_client(channel).consume_messages_batched("email_queue", batches.append, batch_size=3)
+
+    assert batches == [[{"email_id": "1"}, {"email_id": "3"}]]
+    assert channel.nacks == [(2, False, False)]
+    assert channel.acks == [(3, True)]
+
+
+def test_batched_consumer_does_not_ack_the_dropped_last_message():
+    channel = FakeChannel([b'{"email_id": "1"}', b'{"email_id": "2"}', b'not json'])
+    batches = []
+
+    make_client(channel).consume_messages_batched("email_queue", batches.append, batch_size=3)
+
+    assert batches == [[{"email_id": "1"}, {"email_id": "2"}]]
+    assert channel.nacks == [(3, False, False)]
+    assert channel.acks == [(2, True)]
+
+
+def test_batched_consumer_skips_empty_batches_on_the_executor():
+    channel = FakeChannel([b'', b''])
+    batches = []
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        make_client(channel).consume_messages_batched("email_queue", batches.append, batch_size=2, executor=executor)
+
+    assert batches == []
+    assert channel.acks == [(2, True)]
+
+
+def failing_callback(message):
+    raise RuntimeError("database unavailable")
+
+
+def test_consumer_drops_undecodable_message_without_requeue():
+    channel = FakeChannel([b'not json', b'{"email_id": "2"}'])
+    messages = []
+
+    make_client(channel).consume_messages("email_queue", messages.append)
+
+    assert messages == [{"email_id": "2"}]
+    assert channel.nacks == [(1, False, False)]
+    assert channel.acks == [(2, False)]
+
+
+def test_consumer_requeues_a_failed_message_once():
+    channel = FakeChannel([b'{"email_id": "1"}'])
+    make_client(channel).consume_messages("email_queue", failing_callback)
+    assert channel.nacks == [(1, False, True)]
+
+    channel = FakeChannel([b'{"email_id": "1"}'], redelivered=True)
+    make_client(channel).consume_messages("email_queue", failing_callback)
+    assert channel.nacks == [(1, False, False)]
+
+
+def test_batched_consumer_requeues_a_failed_batch_once():
+    channel = FakeChannel([b'{"email_id": "1"}', b'{"email_id": "2"}'])
+    make_client(channel).consume_messages_batched("email_queue", failing_callback, batch_size=2)
+    assert channel.nacks == [(2, True, True)]
+
+    channel = FakeChannel([b'{"email_id": "1"}', b'{"email_id": "2"}'], redelivered=True)
+    make_client(channel).consume_messages_batched("email_queue", failing_callback, batch_size=2)
+    assert channel.nacks == [(2, True, False)]
+
+
+def test_batched_consumer_drops_a_redelivered_failed_batch_on_the_executor():
+    channel = FakeChannel([b'{"email_id": "1"}', b'{"email_id": "2"}'], redelivered=True)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        make_client(channel).consume_messages_batched("email_queue", failing_callback, batch_size=2, executor=executor)
+
+    assert channel.nacks == [(2, True, False)]
+    assert channel.acks == []
+
+
+def test_batched_consumer_requeues_a_batch_whose_reports_were_nacked():
+    channel = FakeChannel([b'{"email_id": "1"}', b'{"email_id": "2"}'])
+    client = make_client(channel)
+
+    def report_lost_by_broker(batch):
+        # What _on_publish_confirm records when the broker nacks a report published for the batch
+        client._nacked_publishes += 1
+
+    client.consume_messages_batched("email_queue", report_lost_by_broker, batch_size=2)
+
+    assert channel.acks == []
+    assert channel.nacks == [(2, True, True)]
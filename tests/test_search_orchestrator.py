@@ -0,0 +1,32 @@
+from email_processor import EmailProcessor
+from search_orchestrator import SearchOrchestrator
+
+
+class FakeEmailProcessor(EmailProcessor):
+    """The real prefilter without the OpenAI client, every email it lets through is not a charter request"""
+
+    def __init__(self):
+        self.analyzed = []
+
+    def analyze_batch(self, email_bodies):
+        self.analyzed.extend(email_bodies)
+        return [{"is_charter_request": False} for _ in email_bodies]
+
+
+def make_orchestrator():
+    orchestrator = SearchOrchestrator.__new__(SearchOrchestrator)
+    orchestrator.email_processor = FakeEmailProcessor()
+    orchestrator.errors = []
+    orchestrator.report_processing_error = lambda message, error: orchestrator.errors.append((message, type(error)))
+    orchestrator.write_vendor_responses = lambda vendor_responses: None
+    return orchestrator
+
+
+def test_process_emails_reports_bad_bodies_and_processes_the_rest():
+    orchestrator = make_orchestrator()
+    email = {"email_id": "3", "content": "Charter a jet for 4 passengers"}
+
+    orchestrator.process_emails(["text", {"email_id": "2", "content": None}, email])
+
+    assert orchestrator.errors == [("text", TypeError), ({"email_id": "2", "content": None}, TypeError)]
+    assert orchestrator.email_processor.analyzed == [email["content"]]